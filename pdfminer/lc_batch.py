@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+"""
+Batch conversion of a folder of PDF files into XML.
+
+Every file is converted with its own PDFResourceManager and
+XMLConverter, so files can be handed out to a pool of worker
+processes. A failure in one file is recorded and the batch moves on.
+With a time or memory limit, the files are converted under a Watchdog:
+a worker that exceeds a limit is killed and its file is quarantined.
+"""
+import sys
+import os
+import os.path
+import time
+import json
+import shutil
+import traceback
+from collections import deque
+from multiprocessing import Pool
+from lc_pdfinterp import PDFResourceManager, PDFPageInterpreter
+from lc_pdfinterp import PDFTextPageInterpreter
+from lc_pdfpage import PDFPage
+from lc_converter import XMLConverter, LegalXMLConverter
+from lc_utils import decode_filename, map_file
+from lc_watchdog import Watchdog
+from lc_schedule import BatchSchedule
+from lc_watch import FolderWatcher
+from lc_xrefindex import get_index
+
+# suffix of the output files that are being written.
+TMP_SUFFIX = '.part'
+
+
+##  BatchJob
+##
+class BatchJob(object):
+
+    """A single PDF to XML conversion of a batch.
+
+    The job only holds plain values so that it can be sent to
+    a worker process.
+    """
+
+    def __init__(self, name, pdf_path, xml_path, laparams=None,
+                 codec='utf-8', password='', caching=True, rotation=0,
+                 make_brief=False, mapped=False, text_only=False, imagemode='all',
+                 xrefcache=None, max_cache_bytes=0):
+        self.name = name
+        self.pdf_path = pdf_path
+        self.xml_path = xml_path
+        self.laparams = laparams
+        self.codec = codec
+        self.password = password
+        self.caching = caching
+        self.rotation = rotation
+        self.make_brief = make_brief
+        self.mapped = mapped
+        self.text_only = text_only
+        self.imagemode = imagemode
+        self.xrefcache = xrefcache
+        self.max_cache_bytes = max_cache_bytes
+        return
+
+    def __repr__(self):
+        return '<BatchJob: %r -> %r>' % (self.pdf_path, self.xml_path)
+
+    def get_params(self):
+        """Returns the parameters that affect the output."""
+        params = {'codec': self.codec, 'rotation': self.rotation,
+                  'make_brief': self.make_brief, 'laparams': None}
+        if self.laparams is not None:
+            params['laparams'] = dict((k, v) for (k, v) in vars(self.laparams).iteritems()
+                                      if isinstance(v, (bool, int, long, float, str)))
+        # only when set, so that the older manifests stay valid.
+        if self.laparams is not None and not self.laparams.ocr_words:
+            del params['laparams']['ocr_words']
+        if self.text_only:
+            params['text_only'] = True
+        if self.imagemode != 'all':
+            params['imagemode'] = self.imagemode
+        return params
+
+
+##  BatchSummary
+##
+class BatchSummary(object):
+
+    """Collects the outcome of every job of a batch."""
+
+    def __init__(self):
+        self.converted = []
+        self.skipped = []
+        self.failed = []
+        self.quarantined = []
+        # (name, [(pageid, message), ...]) of the files with failed pages.
+        self.page_errors = []
+        return
+
+    def __repr__(self):
+        return ('<BatchSummary: converted=%d, skipped=%d, failed=%d, quarantined=%d>' %
+                (len(self.converted), len(self.skipped), len(self.failed),
+                 len(self.quarantined)))
+
+    def add(self, name, error=None, page_errors=()):
+        if error is None:
+            self.converted.append(name)
+        else:
+            self.failed.append((name, error))
+        if page_errors:
+            self.page_errors.append((name, page_errors))
+        return
+
+    def skip(self, name):
+        self.skipped.append(name)
+        return
+
+    def quarantine(self, name, reason, stage):
+        self.quarantined.append((name, reason, stage))
+        return
+
+    def write(self, outfp):
+        print >>outfp, ('Converted %d file(s), skipped %d file(s), %d failure(s).' %
+                        (len(self.converted), len(self.skipped), len(self.failed)))
+        for (name, error) in self.failed:
+            print >>outfp, 'FAILED: %s' % name
+            for line in error.rstrip().splitlines():
+                print >>outfp, '    %s' % line
+        for (name, reason, stage) in self.quarantined:
+            print >>outfp, 'QUARANTINED: %s: %s, at stage %r' % (name, reason, stage)
+        for (name, page_errors) in self.page_errors:
+            print >>outfp, 'PAGE ERRORS: %s: %d page(s)' % (name, len(page_errors))
+            for (pageid, message) in page_errors:
+                print >>outfp, '    page %d: %s' % (pageid, message.encode('utf-8'))
+        return
+
+
+# convert_file
+def convert_file(job, report=None):
+    """Converts one PDF file into an XML file and returns the
+    (pageid, message) of the pages that failed.
+
+    A page that fails is written as an empty page with an error
+    attribute, the conversion goes on with the next page.
+
+    The XML is written to a temporary file next to the output that is
+    renamed when the conversion is complete, so an output file never
+    holds a partial conversion.
+    If given, report(stage) is called whenever the conversion enters
+    a new stage ('parse', 'interpret page N', 'layout page N', 'write').
+    """
+    rsrcmgr = PDFResourceManager(caching=job.caching)
+    if job.make_brief:
+        klass = LegalXMLConverter
+    else:
+        klass = XMLConverter
+    tmppath = job.xml_path + TMP_SUFFIX
+    outfp = file(tmppath, 'w')
+    try:
+        try:
+            device = klass(rsrcmgr, outfp, codec=job.codec, laparams=job.laparams)
+            if report is not None:
+                # the layout analysis is run by the device at the end of a page.
+                end_page = device.end_page
+                def staged_end_page(page):
+                    report('layout page %d' % device.pageno)
+                    return end_page(page)
+                device.end_page = staged_end_page
+                report('parse')
+            fp = file(job.pdf_path, 'rb')
+            if job.mapped:
+                fp = map_file(fp)
+            try:
+                if job.text_only:
+                    interpreter = PDFTextPageInterpreter(rsrcmgr, device, imagemode=job.imagemode)
+                else:
+                    interpreter = PDFPageInterpreter(rsrcmgr, device, imagemode=job.imagemode)
+                for page in PDFPage.get_pages(fp, password=job.password,
+                                              caching=job.caching, check_extractable=True,
+                                              skip_image_data=(job.imagemode != 'all'),
+                                              index=get_index(job.pdf_path, job.xrefcache),
+                                              max_cache_bytes=job.max_cache_bytes):
+                    page.rotate = (page.rotate+job.rotation) % 360
+                    if report is not None:
+                        report('interpret page %d' % device.pageno)
+                    interpreter.try_process_page(page)
+            finally:
+                fp.close()
+            if report is not None:
+                report('write')
+            device.close()
+        finally:
+            outfp.close()
+    except:
+        os.remove(tmppath)
+        raise
+    os.rename(tmppath, job.xml_path)
+    return device.page_errors
+
+
+def run_job(job, journal=None, report=None):
+    """Runs a job and returns (name, error, page_errors).
+
+    error is None on success, or the formatted traceback otherwise.
+    page_errors are the (pageid, message) of the pages that failed.
+    The job is recorded in the BatchJournal, if given.
+    """
+    if journal is not None:
+        journal.started(job.name)
+    try:
+        page_errors = convert_file(job, report=report)
+    except Exception:
+        error = traceback.format_exc()
+        if journal is not None:
+            journal.failed(job.name, error)
+        return (job.name, error, [])
+    if journal is not None:
+        journal.finished(job.name, page_errors=len(page_errors))
+    return (job.name, None, page_errors)
+
+
+def _run_job_args(args):
+    return run_job(*args)
+
+
+def _record_result(summary, manifest, job, error, page_errors, debug=0):
+    if 1 <= debug:
+        print >>sys.stderr, 'batch: %s: %s' % (job.name, 'failed' if error else 'done')
+    summary.add(job.name, error, page_errors)
+    if manifest is not None:
+        if error is None:
+            manifest.update(job.name, job.pdf_path, job.get_params())
+        else:
+            manifest.remove(job.name)
+    return
+
+
+def _record_killed(summary, journal, quarantine, job, (reason, stage)):
+    # the killed worker may have left its temporary output.
+    tmppath = job.xml_path + TMP_SUFFIX
+    if os.path.exists(tmppath):
+        os.remove(tmppath)
+    if journal is not None:
+        journal.quarantined(job.name, reason, stage)
+    if quarantine is not None:
+        quarantine_file(job, quarantine, reason, stage)
+    summary.quarantine(job.name, reason, stage)
+    return
+
+
+def _watch_jobs(watchdog, jobs, summary, journal, quarantine):
+    # yields the results of the completed jobs like a Pool,
+    # the killed ones are quarantined and added to the summary.
+    for (job, result, killed) in watchdog.run(jobs):
+        if killed is None:
+            yield result
+        else:
+            _record_killed(summary, journal, quarantine, job, killed)
+    return
+
+
+# quarantine_file
+def quarantine_file(job, folder, reason, stage):
+    """Moves the input of a job that was killed into the quarantine
+    folder, together with a JSON file that tells why."""
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    shutil.move(job.pdf_path, os.path.join(folder, job.name))
+    fp = file(os.path.join(folder, job.name + '.json'), 'wb')
+    try:
+        json.dump({'name': decode_filename(job.name), 'reason': reason,
+                   'stage': stage, 'time': time.time()},
+                  fp, indent=1, sort_keys=True)
+    finally:
+        fp.close()
+    return
+
+
+# make_job
+def make_job(input_folder, output_folder, name, **kwargs):
+    """Creates the job of a file of the input folder."""
+    pdf_path = os.path.join(input_folder, name)
+    xml_path = os.path.join(output_folder, os.path.splitext(name)[0] + '.xml')
+    return BatchJob(name, pdf_path, xml_path, **kwargs)
+
+
+# make_jobs
+def make_jobs(input_folder, output_folder, **kwargs):
+    """Creates a job for each PDF file of the input folder."""
+    jobs = []
+    for name in sorted(os.listdir(input_folder)):
+        if not os.path.isfile(os.path.join(input_folder, name)):
+            continue
+        jobs.append(make_job(input_folder, output_folder, name, **kwargs))
+    return jobs
+
+
+# run_batch
+def run_batch(jobs, processes=1, manifest=None, journal=None, resume=False,
+              timeout=0, maxrss=0, quarantine=None, schedule=None, dry_run=False,
+              debug=0):
+    """Runs the jobs and returns a BatchSummary.
+
+    With processes > 1 the jobs are spread over a pool of worker
+    processes, otherwise they are run one after another.
+    With a timeout (seconds) or maxrss (bytes), the jobs are run by a
+    Watchdog; the input of a job that exceeds a limit is moved into
+    the quarantine folder, if given.
+    If a BatchManifest is given, the jobs whose input and parameters
+    did not change since the last batch are skipped.
+    If a BatchJournal is given, every job is recorded in it. With
+    resume, the jobs that the journal has as finished are skipped,
+    otherwise the journal is started afresh.
+    With schedule ('pages' or 'size') and processes > 1, the jobs are
+    run largest first, see BatchSchedule. With dry_run, the schedule
+    is printed and nothing is run.
+    """
+    summary = BatchSummary()
+    if journal is not None and resume:
+        finished = journal.get_finished()
+        pending = []
+        for job in jobs:
+            if decode_filename(job.name) in finished and os.path.exists(job.xml_path):
+                summary.skip(job.name)
+            else:
+                pending.append(job)
+        jobs = pending
+    if manifest is not None:
+        pending = []
+        for job in jobs:
+            if manifest.is_current(job.name, job.pdf_path, job.xml_path, job.get_params()):
+                summary.skip(job.name)
+            else:
+                pending.append(job)
+        jobs = pending
+    if dry_run or (schedule is not None and 1 < processes):
+        plan = BatchSchedule(jobs, processes=processes, method=schedule or 'size')
+        if dry_run:
+            plan.write(sys.stdout)
+            return summary
+        jobs = plan.jobs
+    if journal is not None and not resume:
+        journal.reset()
+    byname = dict((job.name, job) for job in jobs)
+    pool = None
+    if timeout or maxrss:
+        watchdog = Watchdog(lambda job, report: run_job(job, journal, report),
+                            processes=processes, timeout=timeout, maxrss=maxrss)
+        results = _watch_jobs(watchdog, jobs, summary, journal, quarantine)
+    elif processes <= 1:
+        results = (run_job(job, journal) for job in jobs)
+    else:
+        pool = Pool(processes)
+        results = pool.imap_unordered(_run_job_args, [(job, journal) for job in jobs])
+    try:
+        for (name, error, page_errors) in results:
+            _record_result(summary, manifest, byname[name], error, page_errors, debug=debug)
+    except KeyboardInterrupt:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if manifest is not None:
+            manifest.save()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return summary
+
+
+# watch_batch
+def watch_batch(input_folder, output_folder, processes=1, maxinflight=None,
+                manifest=None, journal=None, timeout=0, maxrss=0, quarantine=None,
+                settle=5.0, interval=2.0, debug=0, **kwargs):
+    """Converts the files that appear in the input folder, until it
+    is interrupted, and returns a BatchSummary.
+
+    A file is converted once it did not grow for settle seconds. At
+    most maxinflight files (by default, twice the number of processes)
+    are handed to the workers at a time, the others wait in a queue.
+    The other arguments are as for run_batch(), kwargs are the options
+    of the jobs.
+    """
+    if maxinflight is None:
+        maxinflight = 2*processes
+    summary = BatchSummary()
+    if journal is not None:
+        journal.reset()
+    watcher = FolderWatcher(input_folder, settle=settle, interval=interval)
+    watchdog = Watchdog(lambda job, report: run_job(job, journal, report),
+                        processes=processes, timeout=timeout, maxrss=maxrss)
+    queue = deque()
+    try:
+        while 1:
+            if len(watchdog):
+                results = watchdog.poll()
+                names = watcher.poll(0)
+            else:
+                results = []
+                names = watcher.poll()
+            for name in names:
+                job = make_job(input_folder, output_folder, name, **kwargs)
+                if manifest is not None:
+                    manifest.refresh(name)
+                    if manifest.is_current(job.name, job.pdf_path, job.xml_path,
+                                           job.get_params()):
+                        summary.skip(job.name)
+                        continue
+                queue.append(job)
+            while queue and len(watchdog) < maxinflight:
+                watchdog.submit(queue.popleft())
+            for (job, result, killed) in results:
+                if killed is None:
+                    (_, error, page_errors) = result
+                    _record_result(summary, manifest, job, error, page_errors)
+                    if error:
+                        print >>sys.stderr, '%s: failed' % job.name
+                    elif page_errors:
+                        print >>sys.stderr, '%s: converted, %d page(s) failed' % \
+                              (job.name, len(page_errors))
+                    else:
+                        print >>sys.stderr, '%s: converted' % job.name
+                else:
+                    _record_killed(summary, journal, quarantine, job, killed)
+                    print >>sys.stderr, '%s: quarantined: %s, at stage %r' % \
+                          ((job.name,)+killed)
+            if results and manifest is not None:
+                manifest.save()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for job in watchdog.close():
+            tmppath = job.xml_path + TMP_SUFFIX
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+        watcher.close()
+        if manifest is not None:
+            manifest.save()
+    return summary
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks of the parser and the interpreter.
+
+Every benchmark runs a single piece of the conversion over the pages
+of a file several times and reports the best time, so that two trees
+can be compared on the same file:
+
+  operators   the content streams of the pages are executed by a
+              PDFPageInterpreter over a device that draws nothing;
+              reports the operators per second.
+  inline      the content streams of the pages are only parsed;
+              reports the inline images (BI ... ID ... EI) per
+              second, for pages with large inline images.
+"""
+import sys
+import time
+from pdfminer.lc_pdfdocument import PDFDocument
+from pdfminer.lc_pdfparser import PDFParser
+from pdfminer.lc_pdfinterp import PDFResourceManager, PDFPageInterpreter
+from pdfminer.lc_pdfinterp import PDFContentParser
+from pdfminer.lc_pdfdevice import PDFDevice
+from pdfminer.lc_pdfpage import PDFPage
+from pdfminer.lc_pdftypes import PDFStream, list_value, stream_value
+from pdfminer.lc_psparser import PSKeyword, PSEOF
+
+
+# best_time
+def best_time(func, repeat):
+    """Returns the shortest time of repeat calls of func()."""
+    best = None
+    for _ in xrange(repeat):
+        t0 = time.time()
+        func()
+        t = time.time()-t0
+        if best is None or t < best:
+            best = t
+    return best
+
+
+# count_operators
+def count_operators(page):
+    """Returns the number of operators in the contents of a page."""
+    if not page.contents:
+        return 0
+    try:
+        parser = PDFContentParser(list_value(page.contents))
+    except PSEOF:
+        return 0
+    n = 0
+    while 1:
+        try:
+            (_, obj) = parser.nextobject()
+        except PSEOF:
+            break
+        if isinstance(obj, PSKeyword):
+            n += 1
+    return n
+
+
+# bench_operators
+def bench_operators(pages, repeat=5):
+    """Returns (operators, seconds) for executing the pages."""
+    rsrcmgr = PDFResourceManager()
+    interpreter = PDFPageInterpreter(rsrcmgr, PDFDevice(rsrcmgr))
+
+    def run():
+        for page in pages:
+            interpreter.process_page(page)
+        return
+    # the first run loads the fonts and decodes the streams.
+    run()
+    nops = sum(count_operators(page) for page in pages)
+    return (nops, best_time(run, repeat))
+
+
+# bench_inline
+def bench_inline(pages, repeat=5):
+    """Returns (inline images, seconds) for parsing the contents."""
+    streams = [list_value(page.contents) for page in pages if page.contents]
+    for s in streams:
+        for stream in s:
+            # decoded once, outside of the timing.
+            stream_value(stream).get_data()
+
+    def run():
+        n = 0
+        for s in streams:
+            try:
+                parser = PDFContentParser(s)
+            except PSEOF:
+                continue
+            for (_, obj) in parser.iterobjects():
+                if isinstance(obj, PDFStream):
+                    n += 1
+        return n
+    return (run(), best_time(run, repeat))
+
+
+BENCHMARKS = {
+    'operators': bench_operators,
+    'inline': bench_inline,
+}
+
+
+# main
+def main(argv):
+    import getopt
+    def usage():
+        print ('usage: %s [-p pagenos] [-n repeat] [-P password] {%s} file.pdf' %
+               (argv[0], '|'.join(sorted(BENCHMARKS))))
+        return 100
+    try:
+        (opts, args) = getopt.getopt(argv[1:], 'p:n:P:')
+    except getopt.GetoptError:
+        return usage()
+    if len(args) != 2 or args[0] not in BENCHMARKS: return usage()
+    pagenos = set()
+    repeat = 5
+    password = ''
+    for (k, v) in opts:
+        if k == '-p': pagenos.update( int(x)-1 for x in v.split(',') )
+        elif k == '-n': repeat = int(v)
+        elif k == '-P': password = v
+    (name, fname) = args
+    fp = file(fname, 'rb')
+    doc = PDFDocument(PDFParser(fp), password=password)
+    pages = [page for (pageno, page) in enumerate(PDFPage.create_pages(doc))
+             if not pagenos or pageno in pagenos]
+    (count, t) = BENCHMARKS[name](pages, repeat=repeat)
+    print '%s: %d page(s), %d in %.3fs, %d/s' % (name, len(pages), count, t, count/max(t, 1e-9))
+    fp.close()
+    return
+
+if __name__ == '__main__': sys.exit(main(sys.argv))
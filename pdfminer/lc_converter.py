@@ -4,16 +4,29 @@ import sys
 import os.path
 import unicodedata
 import string
+import traceback
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
 from lc_pdfdevice import PDFTextDevice
 from lc_pdffont import PDFUnicodeNotDefined
 from lc_layout import LTContainer, LTPage, LTText, LTLine, LTRect, LTCurve
 from lc_layout import LTFigure, LTImage, LTChar, LTTextLine, LTTextWord, LTImageBoxContainer,  LTExpandableContainer, LTTextColumn
+from lc_layout import LTTextWordHorizontal
 from lc_layout import LTTextBox, LTTextBoxVertical, LTTextGroup, LTTextColumnGroup
 from lc_utils import apply_matrix_pt, mult_matrix
 from lc_utils import enc, bbox2str
 from math import ceil
 
 
+# page_error_message
+def page_error_message(error):
+    """Returns a one-line description of the error of a failed page."""
+    message = traceback.format_exception_only(error.__class__, error)[-1].strip()
+    return unicode(message, 'utf-8', 'replace')
+
+
 ##  PDFLayoutAnalyzer
 ##
 class PDFLayoutAnalyzer(PDFTextDevice):
@@ -23,6 +36,9 @@ class PDFLayoutAnalyzer(PDFTextDevice):
         self.pageno = pageno
         self.laparams = laparams
         self._stack = []
+        self._pageid = None
+        # (pageid, message) of the pages that failed.
+        self.page_errors = []
         return
 
     def begin_page(self, page, ctm):
@@ -31,6 +47,7 @@ class PDFLayoutAnalyzer(PDFTextDevice):
         #(x1, y1) = apply_matrix_pt(ctm, (x1, y1))
         #mediabox = (0, 0, abs(x0-x1), abs(y0-y1))
         cropbox = page.cropbox
+        self._pageid = self.pageno
         self.cur_item = LTPage(self.pageno, cropbox)
         return
 
@@ -40,7 +57,33 @@ class PDFLayoutAnalyzer(PDFTextDevice):
         if self.laparams is not None:
             self.cur_item.analyze(self.laparams)
         self.pageno += 1
-        self.receive_layout(self.cur_item)
+        self.receive_page(self.cur_item)
+        self._pageid = None
+        return
+
+    def abort_page(self, page, error):
+        """Gives up a page that failed and records it as failed.
+
+        The failure may be anywhere between begin_page() and the end
+        of end_page(), the page counter is set past the page either way.
+        """
+        if self._pageid is None:
+            pageid = self.pageno
+        else:
+            pageid = self._pageid
+        self._stack = []
+        self._pageid = None
+        self.pageno = pageid+1
+        self.page_failed(pageid, page_error_message(error))
+        return
+
+    def page_failed(self, pageid, message):
+        self.page_errors.append((pageid, message))
+        self.receive_page_error(pageid, message)
+        return
+
+    def receive_page(self, ltpage):
+        self.receive_layout(ltpage)
         return
 
     def begin_figure(self, name, bbox, matrix):
@@ -96,6 +139,36 @@ class PDFLayoutAnalyzer(PDFTextDevice):
         self.cur_item.add(LTCurve(gstate.linewidth, pts))
         return
 
+    def render_string(self, textstate, seq):
+        # OCR engines write every word of their invisible text layer
+        # as one string, so with laparams.ocr_words such a string is
+        # made a word here instead of being regrouped from its chars.
+        # The text of figures is only laid out with all_texts.
+        if (self.laparams is None or not self.laparams.ocr_words or
+            textstate.render != 3 or textstate.font.is_vertical() or
+            not (isinstance(self.cur_item, LTPage) or self.laparams.all_texts)):
+            PDFTextDevice.render_string(self, textstate, seq)
+            return
+        item = self.cur_item
+        self.cur_item = LTContainer((0, 0, 0, 0))
+        try:
+            PDFTextDevice.render_string(self, textstate, seq)
+        finally:
+            (chars, self.cur_item) = (self.cur_item, item)
+        word = None
+        for char in chars:
+            if char.get_text().isspace():
+                if word is not None and len(word):
+                    item.add(word)
+                word = None
+            else:
+                if word is None:
+                    word = LTTextWordHorizontal(self.laparams.char_margin_horizontal)
+                word.add(char)
+        if word is not None and len(word):
+            item.add(word)
+        return
+
     def render_char(self, matrix, font, fontsize, fontcolor, scaling, rise, cid):
         try:
             text = font.to_unichr(cid)
@@ -116,6 +189,9 @@ class PDFLayoutAnalyzer(PDFTextDevice):
     def receive_layout(self, ltpage):
         return
 
+    def receive_page_error(self, pageid, message):
+        return
+
 
 ##  PDFPageAggregator
 ##
@@ -144,6 +220,19 @@ class PDFConverter(PDFLayoutAnalyzer):
         self.codec = codec
         return
 
+    def receive_page(self, ltpage):
+        # the page is written to a buffer first, so that a page
+        # that fails half-way does not leave a part of it behind.
+        outfp = self.outfp
+        self.outfp = StringIO()
+        try:
+            self.receive_layout(ltpage)
+            data = self.outfp.getvalue()
+        finally:
+            self.outfp = outfp
+        self.outfp.write(data)
+        return
+
 
 ##  TextConverter
 ##
@@ -384,6 +473,13 @@ class HTMLConverter(PDFConverter):
         self._yoffset += self.pagemargin
         return
 
+    def receive_page_error(self, pageid, message):
+        self.write('<div style="position:absolute; top:%dpx;">' % (self._yoffset*self.scale))
+        self.write('<a name="%s">Page %s</a>: %s</div>\n' %
+                   (pageid, pageid, enc(message, self.codec)))
+        self._yoffset += self.pagemargin
+        return
+
     def close(self):
         self.write_footer()
         return
@@ -1040,6 +1136,10 @@ class XMLConverter(PDFConverter):
         render(ltpage)
         return
 
+    def receive_page_error(self, pageid, message):
+        self.outfp.write('<page id="%s" error="%s">\n</page>\n' % (pageid, enc(message, self.codec)))
+        return
+
     def filter_non_printable(self, str):
         return ''.join([c for c in str if ord(c) > 31 or ord(c) == 9])
     def close(self):
@@ -1696,6 +1796,10 @@ class LegalXMLConverter(PDFConverter):
         render(ltpage)
         return
 
+    def receive_page_error(self, pageid, message):
+        self.outfp.write('<page id="%s" error="%s">\n</page>\n' % (pageid, enc(message, self.codec)))
+        return
+
     def filter_non_printable(self, str):
         return ''.join([c for c in str if ord(c) > 31 or ord(c) == 9])
     def close(self):
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Journal of a running batch.
+
+Every job appends a 'started' record when a worker picks it up and a
+'finished' or 'failed' record when it is done, or a 'quarantined'
+record when the worker was killed by the watchdog. The journal is an
+append-only file of JSON lines, so it survives a crash of the batch
+and tells a resumed batch which files are already converted.
+"""
+import os
+import os.path
+import time
+import json
+from lc_utils import decode_filename
+
+JOURNAL_NAME = '.pdfengine-journal'
+
+STARTED = 'started'
+FINISHED = 'finished'
+FAILED = 'failed'
+QUARANTINED = 'quarantined'
+
+
+##  BatchJournal
+##
+class BatchJournal(object):
+
+    """Append-only record of the jobs of a batch.
+
+    The journal only holds its path, so it can be handed to worker
+    processes which write their own records. Each record is a single
+    short write to a file opened in append mode, so records of
+    concurrent workers do not interleave.
+    """
+
+    def __init__(self, folder, name=JOURNAL_NAME):
+        self.path = os.path.join(folder, name)
+        return
+
+    def __repr__(self):
+        return '<BatchJournal: %r>' % self.path
+
+    def reset(self):
+        """Starts a new, empty journal."""
+        file(self.path, 'wb').close()
+        return
+
+    def write(self, event, name, **kwargs):
+        record = {'time': time.time(), 'event': event, 'name': decode_filename(name),
+                  'pid': os.getpid()}
+        record.update(kwargs)
+        fp = file(self.path, 'ab')
+        try:
+            fp.write(json.dumps(record, sort_keys=True) + '\n')
+        finally:
+            fp.close()
+        return
+
+    def started(self, name):
+        self.write(STARTED, name)
+        return
+
+    def finished(self, name, page_errors=0):
+        self.write(FINISHED, name, page_errors=page_errors)
+        return
+
+    def failed(self, name, error):
+        self.write(FAILED, name, error=unicode(error, 'utf-8', 'replace'))
+        return
+
+    def quarantined(self, name, reason, stage):
+        self.write(QUARANTINED, name, reason=reason, stage=stage)
+        return
+
+    def read(self):
+        """Yields the records of the journal.
+
+        A truncated last line (the batch died while writing it)
+        is ignored.
+        """
+        if not os.path.exists(self.path):
+            return
+        fp = file(self.path, 'rb')
+        try:
+            for line in fp:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+        finally:
+            fp.close()
+        return
+
+    def get_states(self):
+        """Returns a dictionary of the last event of every job."""
+        states = {}
+        for record in self.read():
+            states[record['name']] = record['event']
+        return states
+
+    def get_finished(self):
+        """Returns the set of jobs that were finished.
+
+        Names are returned as Unicode, see decode_filename().
+        """
+        return set(name for (name, event) in self.get_states().iteritems()
+                   if event == FINISHED)
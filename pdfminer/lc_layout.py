@@ -84,7 +84,8 @@ class LAParams(object):
                  boxes_flow=0.5,
                  detect_vertical=False,
                  all_texts=False,
-                 unmarked_list_word_count_margin = 1):
+                 unmarked_list_word_count_margin = 1,
+                 ocr_words=False):
         self.line_overlap = line_overlap
         self.line_margin = line_margin
         self.line_start_position_margin = line_start_position_margin
@@ -102,6 +103,8 @@ class LAParams(object):
         self.closed_curves = {}
         self.closed_curve_index = 0
         self.unmarked_list_word_count_margin = unmarked_list_word_count_margin
+        # invisible strings (Tr 3) are taken as whole words.
+        self.ocr_words = ocr_words
         return
 
     def __repr__(self):
@@ -266,6 +269,13 @@ class LTImage(LTComponent):
         LTComponent.__init__(self, bbox)
         self.name = name
         self.stream = stream
+        if stream is None:
+            # only the placement of the image is known.
+            self.srcsize = (None, None)
+            self.imagemask = None
+            self.bits = None
+            self.colorspace = []
+            return
         self.srcsize = (stream.get_any(('W', 'Width')),
                         stream.get_any(('H', 'Height')))
         self.imagemask = stream.get_any(('IM', 'ImageMask'))
@@ -1706,6 +1716,9 @@ class LTLayoutContainer(LTContainer):
         # textobjs is a list of LTChar objects, i.e.
         # it has all the individual characters in the page.
         (textobjects, otherobjects) = fsplit(lambda  obj: isinstance(obj, LTChar), self._objs)
+        # the words of an OCR text layer are made by the device
+        # (see PDFLayoutAnalyzer.render_string).
+        (ocrwords, otherobjects) = fsplit(lambda obj: isinstance(obj, LTTextWord), otherobjects)
 
         #(Sridhar) Added to escape space character
         for textobj in textobjects:
@@ -1716,11 +1729,13 @@ class LTLayoutContainer(LTContainer):
         for obj in otherobjects:
             obj.analyze(laparams)
 
-        if len(textobjects) == 0:
+        if len(textobjects) == 0 and len(ocrwords) == 0:
             print 'Layout.py (analyze method) line no. 1246: Returning without doing anything since no characters were found'
             return
 
-        words =list(self.get_textwords(laparams,textobjects))
+        words = ocrwords
+        if textobjects:
+            words = words + list(self.get_textwords(laparams,textobjects))
         #print 'words found',words
         if not words:
             print 'Layout.py (analyze method) line no. 1250: Returning without doing anything since no words were found'
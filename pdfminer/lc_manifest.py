@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+Manifest of the files converted by a batch.
+
+The manifest is kept in the output folder and records, for every
+input file, its size, mtime and content hash together with the
+conversion parameters and the engine version. A later batch skips the
+files whose entry still matches.
+"""
+import sys
+import os
+import os.path
+import json
+import hashlib
+from pdfminer import __version__
+from lc_utils import decode_filename
+
+MANIFEST_NAME = '.pdfengine-manifest.json'
+MANIFEST_FORMAT = 1
+
+
+# file_digest
+def file_digest(path, bufsize=1024*1024):
+    """Returns the SHA-1 hex digest of a file's content."""
+    digest = hashlib.sha1()
+    fp = file(path, 'rb')
+    try:
+        while 1:
+            data = fp.read(bufsize)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        fp.close()
+    return digest.hexdigest()
+
+
+##  BatchManifest
+##
+class BatchManifest(object):
+
+    """Remembers which inputs were converted with which parameters.
+
+    Typical usage:
+      manifest = BatchManifest(output_folder)
+      if not manifest.is_current(name, pdf_path, xml_path, params):
+          (convert the file)
+          manifest.update(name, pdf_path, params)
+      manifest.save()
+    """
+
+    debug = 0
+
+    def __init__(self, folder, name=MANIFEST_NAME, version=__version__):
+        self.path = os.path.join(folder, name)
+        self.version = version
+        self.entries = {}
+        self._stats = {}
+        if os.path.exists(self.path):
+            fp = file(self.path, 'rb')
+            try:
+                data = json.load(fp)
+            finally:
+                fp.close()
+            if data.get('format') == MANIFEST_FORMAT:
+                self.entries = data.get('files', {})
+        return
+
+    def __repr__(self):
+        return '<BatchManifest: %r, entries=%d>' % (self.path, len(self.entries))
+
+    def _stat(self, name, pdf_path):
+        # the size and mtime of an input are taken once, before
+        # it is converted, so that a file that changes during
+        # its conversion is picked up by the next batch.
+        name = decode_filename(name)
+        if name not in self._stats:
+            st = os.stat(pdf_path)
+            self._stats[name] = {'size': st.st_size, 'mtime': st.st_mtime}
+        return self._stats[name]
+
+    def is_current(self, name, pdf_path, xml_path, params):
+        """Returns True if the input does not need to be converted again."""
+        entry = self.entries.get(decode_filename(name))
+        if entry is None or not os.path.exists(xml_path):
+            return False
+        if entry.get('version') != self.version or entry.get('params') != params:
+            return False
+        stat = self._stat(name, pdf_path)
+        if entry.get('size') != stat['size']:
+            return False
+        if entry.get('mtime') != stat['mtime']:
+            # touched, but maybe not modified.
+            stat['hash'] = file_digest(pdf_path)
+            if entry.get('hash') != stat['hash']:
+                return False
+            entry['mtime'] = stat['mtime']
+        if 1 <= self.debug:
+            print >>sys.stderr, 'manifest: unchanged: %r' % name
+        return True
+
+    def update(self, name, pdf_path, params):
+        """Records a successful conversion."""
+        entry = dict(self._stat(name, pdf_path))
+        if 'hash' not in entry:
+            entry['hash'] = file_digest(pdf_path)
+        entry['version'] = self.version
+        entry['params'] = params
+        self.entries[decode_filename(name)] = entry
+        return
+
+    def refresh(self, name):
+        """Forgets the size and mtime of an input that may have changed."""
+        self._stats.pop(decode_filename(name), None)
+        return
+
+    def remove(self, name):
+        self.entries.pop(decode_filename(name), None)
+        return
+
+    def save(self):
+        """Writes the manifest; the old one is replaced atomically."""
+        tmppath = self.path + '.tmp'
+        fp = file(tmppath, 'wb')
+        try:
+            json.dump({'format': MANIFEST_FORMAT, 'files': self.entries},
+                      fp, indent=1, sort_keys=True)
+        finally:
+            fp.close()
+        os.rename(tmppath, self.path)
+        return
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""
+Page-sharded conversion of a single PDF file.
+
+The pages of a document are split into ranges of consecutive pages.
+Each range is interpreted and laid out by a worker process that opens
+the file by itself, and the resulting LTPage objects are sent back to
+the calling process. There they are passed to the device's
+receive_page() strictly in page order, so the converter sees exactly
+the same sequence of pages as in a serial run and all its running
+counters (line_id, word_id, image_id, ...) come out the same.
+"""
+import sys
+from multiprocessing import Pool
+from lc_pdftypes import PDFStream
+from lc_pdftypes import resolve_all
+from lc_pdfparser import PDFParser
+from lc_pdfdocument import PDFDocument
+from lc_pdfdocument import PDFTextExtractionNotAllowed
+from lc_pdfinterp import PDFResourceManager, PDFPageInterpreter
+from lc_pdfinterp import PDFTextPageInterpreter
+from lc_pdfpage import PDFPage, PDFPageIndex
+from lc_converter import PDFPageAggregator, page_error_message
+from lc_utils import map_file
+from lc_xrefindex import get_index
+from lc_layout import LTContainer, LTImage
+
+
+# select_pages
+def select_pages(fp, pagenos=None, maxpages=0, password='',
+                 caching=True, check_extractable=True, index=None):
+    """Returns the indexes of the pages that PDFPage.get_pages() yields."""
+    parser = PDFParser(fp)
+    doc = PDFDocument(parser, password=password, caching=caching, index=index)
+    if check_extractable and not doc.is_extractable:
+        raise PDFTextExtractionNotAllowed('Text extraction is not allowed: %r' % fp)
+    # as in PDFPage.get_pages(), a selection is found with an index.
+    if pagenos or maxpages:
+        pageindex = PDFPageIndex(doc)
+        if len(pageindex):
+            return pageindex.select(pagenos, maxpages)
+    selected = []
+    for (pageno, page) in enumerate(PDFPage.create_pages(doc)):
+        if pagenos and (pageno not in pagenos):
+            continue
+        selected.append(pageno)
+        if maxpages and maxpages <= pageno+1:
+            break
+    return selected
+
+
+# split_pages
+def split_pages(pagenos, nshards):
+    """Splits a list of page indexes into at most nshards ranges
+    of consecutive pages of (almost) equal length."""
+    nshards = max(1, min(nshards, len(pagenos)))
+    (size, extra) = divmod(len(pagenos), nshards)
+    shards = []
+    i = 0
+    for n in xrange(nshards):
+        j = i + size + (n < extra)
+        shards.append(pagenos[i:j])
+        i = j
+    return shards
+
+
+# detach_layout
+def detach_layout(item):
+    """Cuts the references from a layout to its PDFDocument.
+
+    Image streams may hold indirect references and a decipher
+    method that both point back to the document and its open
+    file. They are replaced with self-contained copies so that
+    the layout can be pickled.
+    """
+    if isinstance(item, LTImage) and item.stream is not None:
+        stream = item.stream
+        if stream.decipher is not None and stream.data is None:
+            stream.decode()
+        attrs = resolve_all(dict(stream.attrs))
+        detached = PDFStream(attrs, stream.rawdata)
+        detached.data = stream.data
+        detached.set_objid(stream.objid, stream.genno)
+        item.stream = detached
+        item.srcsize = resolve_all(item.srcsize)
+        item.imagemask = resolve_all(item.imagemask)
+        item.bits = resolve_all(item.bits)
+        item.colorspace = resolve_all(item.colorspace)
+    if isinstance(item, LTContainer):
+        for child in item:
+            detach_layout(child)
+    return item
+
+
+# layout_shard
+def layout_shard((fname, shard, firstpageno, laparams, password, caching, rotation, mapped,
+                  text_only, imagemode, xrefcache, max_cache_bytes)):
+    """Interprets and lays out the pages of one shard.
+
+    shard is a list of (seqno, pageno) pairs: seqno is the position of
+    the page in the serial run and pageno its index in the document.
+    Returns a list of (seqno, LTPage, None), or (seqno, None, message)
+    for a page that failed.
+    """
+    rsrcmgr = PDFResourceManager(caching=caching)
+    device = PDFPageAggregator(rsrcmgr, laparams=laparams)
+    if text_only:
+        interpreter = PDFTextPageInterpreter(rsrcmgr, device, imagemode=imagemode)
+    else:
+        interpreter = PDFPageInterpreter(rsrcmgr, device, imagemode=imagemode)
+    seqnos = dict((pageno, seqno) for (seqno, pageno) in shard)
+    maxpages = max(seqnos.iterkeys())+1
+    layouts = []
+    fp = file(fname, 'rb')
+    if mapped:
+        fp = map_file(fp)
+    try:
+        pages = PDFPage.get_pages(fp, set(seqnos), maxpages=maxpages,
+                                  password=password, caching=caching,
+                                  check_extractable=False,
+                                  skip_image_data=(imagemode != 'all'),
+                                  index=get_index(fname, xrefcache),
+                                  max_cache_bytes=max_cache_bytes)
+        for (pageno, page) in zip(sorted(seqnos), pages):
+            seqno = seqnos[pageno]
+            device.pageno = firstpageno+seqno
+            page.rotate = (page.rotate+rotation) % 360
+            if interpreter.try_process_page(page):
+                layouts.append((seqno, detach_layout(device.get_result()), None))
+            else:
+                (_, message) = device.page_errors[-1]
+                layouts.append((seqno, None, message))
+    finally:
+        fp.close()
+    return layouts
+
+
+# process_pdf_sharded
+def process_pdf_sharded(device, fname, pagenos=None, maxpages=0, password='',
+                        caching=True, check_extractable=True, rotation=0,
+                        processes=2, shards_per_process=4, mapped=False,
+                        text_only=False, imagemode='all', xrefcache=None,
+                        max_cache_bytes=0, debug=0):
+    """Converts a PDF file with a pool of worker processes.
+
+    device must be a PDFLayoutAnalyzer (such as XMLConverter); its
+    laparams are used by the workers. The output is the same as
+    running PDFPageInterpreter.process_page() over every page.
+    With mapped, the file is parsed from a memory map. With text_only,
+    the pages are interpreted by a PDFTextPageInterpreter. imagemode
+    is passed to the interpreters; the data of the images are not
+    read unless it is 'all'. With xrefcache, the xrefs of the file
+    are kept in an XRefIndex in that folder, so that the workers do
+    not read them again. max_cache_bytes bounds the streams that the
+    document of each worker keeps.
+    """
+    fp = file(fname, 'rb')
+    if mapped:
+        fp = map_file(fp)
+    try:
+        selected = select_pages(fp, pagenos=pagenos, maxpages=maxpages,
+                                password=password, caching=caching,
+                                check_extractable=check_extractable,
+                                index=get_index(fname, xrefcache))
+    finally:
+        fp.close()
+    if not selected:
+        return
+    seq = list(enumerate(selected))
+    shards = split_pages(seq, processes*shards_per_process)
+    if 1 <= debug:
+        print >>sys.stderr, 'process_pdf_sharded: %r: pages=%d, shards=%d' % \
+              (fname, len(seq), len(shards))
+    args = [(fname, shard, device.pageno, device.laparams, password, caching, rotation, mapped,
+             text_only, imagemode, xrefcache, max_cache_bytes)
+            for shard in shards]
+    pool = Pool(processes)
+    try:
+        # imap() returns the shards in order.
+        for layouts in pool.imap(layout_shard, args):
+            for (seqno, ltpage, message) in layouts:
+                pageid = device.pageno
+                device.pageno += 1
+                if ltpage is None:
+                    device.page_failed(pageid, message)
+                    continue
+                try:
+                    device.receive_page(ltpage)
+                except Exception, e:
+                    device.page_failed(pageid, page_error_message(e))
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+    return
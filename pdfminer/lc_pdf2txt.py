@@ -3,12 +3,16 @@ import sys
 from pdfminer.lc_pdfdocument import PDFDocument
 from pdfminer.lc_pdfparser import PDFParser
 from pdfminer.lc_pdfinterp import PDFResourceManager, PDFPageInterpreter
+from pdfminer.lc_pdfinterp import PDFTextPageInterpreter
 from pdfminer.lc_pdfdevice import PDFDevice, TagExtractor
 from pdfminer.lc_pdfpage import PDFPage
 from pdfminer.lc_converter import XMLConverter, HTMLConverter, TextConverter, LegalXMLConverter
 from pdfminer.lc_cmapdb import CMapDB
 from pdfminer.lc_layout import LAParams
 from pdfminer.lc_image import ImageWriter
+from pdfminer.lc_pageshard import process_pdf_sharded
+from pdfminer.lc_utils import map_file
+from pdfminer.lc_xrefindex import XRefIndex, get_index
 
 # main
 def main(argv):
@@ -17,11 +21,12 @@ def main(argv):
         print ('usage: %s [-d] [-B make_brief] [-p pagenos] [-m maxpages] [-P password] [-o output]'
                ' [-C] [-n] [-A] [-V] [-M char_margin] [-L line_margin] [-W word_margin]'
                ' [-F boxes_flow] [-Y layout_mode] [-O output_dir] [-R rotation]'
-               ' [-t text|html|xml|tag] [-c codec] [-s scale]'
+               ' [-t text|html|xml|tag] [-c codec] [-s scale] [-j processes] [-z] [-T]'
+               ' [-I all|bbox|none] [-G] [-X index folder] [-K cache megabytes]'
                ' file ...' % argv[0])
         return 100
     try:
-        (opts, args) = getopt.getopt(argv[1:], 'dBp:m:P:o:CnAVM:L:W:F:Y:O:R:t:c:s:')
+        (opts, args) = getopt.getopt(argv[1:], 'dBp:m:P:o:CnAVM:L:W:F:Y:O:R:t:c:s:j:zTI:GX:K:')
     except getopt.GetoptError:
         return usage()
     if not args: return usage()
@@ -43,6 +48,12 @@ def main(argv):
     caching = True
     showpageno = True
     make_brief_xml = False
+    processes = 1
+    mapped = False
+    interpreter_class = PDFPageInterpreter
+    imagemode = 'all'
+    xrefcache = None
+    max_cache_bytes = 0
     laparams = LAParams()
     for (k, v) in opts:
         if k == '-d': debug += 1
@@ -54,6 +65,7 @@ def main(argv):
         elif k == '-n': laparams = None
         elif k == '-A': laparams.all_texts = True
         elif k == '-V': laparams.detect_vertical = True
+        elif k == '-G': laparams.ocr_words = True
         elif k == '-M': laparams.char_margin = float(v)
         elif k == '-L': laparams.line_margin = float(v)
         elif k == '-W': laparams.word_margin = float(v)
@@ -64,6 +76,12 @@ def main(argv):
         elif k == '-t': outtype = v
         elif k == '-c': codec = v
         elif k == '-s': scale = float(v)
+        elif k == '-j': processes = int(v)
+        elif k == '-z': mapped = True
+        elif k == '-T': interpreter_class = PDFTextPageInterpreter
+        elif k == '-I': imagemode = v
+        elif k == '-X': xrefcache = v
+        elif k == '-K': max_cache_bytes = int(v)*1024*1024
         elif k == '-B':
             make_brief_xml = True
             print 'reached here'
@@ -74,6 +92,7 @@ def main(argv):
     PDFResourceManager.debug = debug
     PDFPageInterpreter.debug = debug
     PDFDevice.debug = debug
+    XRefIndex.debug = debug
     #
     rsrcmgr = PDFResourceManager(caching=caching)
     if not outtype:
@@ -107,16 +126,43 @@ def main(argv):
         device = TagExtractor(rsrcmgr, outfp, codec=codec)
     else:
         return usage()
+    if 1 < processes and outtype == 'tag':
+        return usage()
+    # the images cannot be extracted without their data.
+    if imagemode not in ('all', 'bbox', 'none') or (imagemode != 'all' and imagewriter):
+        return usage()
     for fname in args:
+        if 1 < processes:
+            process_pdf_sharded(device, fname, pagenos=pagenos,
+                                maxpages=maxpages, password=password,
+                                caching=caching, rotation=rotation,
+                                processes=processes, mapped=mapped,
+                                text_only=(interpreter_class is PDFTextPageInterpreter),
+                                imagemode=imagemode, xrefcache=xrefcache,
+                                max_cache_bytes=max_cache_bytes, debug=debug)
+            continue
         fp = file(fname, 'rb')
-        interpreter = PDFPageInterpreter(rsrcmgr, device)
+        if mapped:
+            fp = map_file(fp)
+        interpreter = interpreter_class(rsrcmgr, device, imagemode=imagemode)
+        doc = None
         for page in PDFPage.get_pages(fp, pagenos,
                                       maxpages=maxpages, password=password,
-                                      caching=caching, check_extractable=True):
+                                      caching=caching, check_extractable=True,
+                                      skip_image_data=(imagemode != 'all'),
+                                      index=get_index(fname, xrefcache),
+                                      max_cache_bytes=max_cache_bytes):
             page.rotate = (page.rotate+rotation) % 360
-            interpreter.process_page(page)
+            interpreter.try_process_page(page)
+            doc = page.doc
         fp.close()
+        if 1 <= debug and doc is not None:
+            print >>sys.stderr, doc.cache
     device.close()
+    if 1 <= debug:
+        print >>sys.stderr, rsrcmgr
+    for (pageid, message) in getattr(device, 'page_errors', []):
+        print >>sys.stderr, 'page %d failed: %s' % (pageid, message.encode('utf-8'))
     outfp.close()
     return
 
@@ -40,6 +40,9 @@ class PDFDevice(object):
     def end_page(self, page):
         return
 
+    def abort_page(self, page, error):
+        return
+
     def begin_figure(self, name, bbox, matrix):
         return
 
@@ -122,6 +125,100 @@ class PDFTextDevice(PDFDevice):
         return 0
 
 
+##  PDFRecorder
+##
+class PDFRecorder(PDFDevice):
+
+    """Records the calls made to a device so that they can be replayed
+    on another device under another CTM.
+
+    The recorded CTMs are relative to the CTM of the recording and
+    are multiplied by the CTM given to replay(). The strings are not
+    laid out here: a string whose position was not set again after
+    the previous one is replayed from where the replaying device
+    ended that one.
+    """
+
+    def __init__(self, rsrcmgr):
+        PDFDevice.__init__(self, rsrcmgr)
+        self.calls = []
+        self.nstrings = 0
+        # {id(linematrix): (linematrix, index of the string it ends)}
+        self._ends = {}
+        return
+
+    def __repr__(self):
+        return '<PDFRecorder: calls=%d>' % len(self.calls)
+
+    def set_ctm(self, ctm):
+        self.ctm = ctm
+        self.calls.append(('set_ctm', ctm))
+        return
+
+    def begin_tag(self, tag, props=None):
+        self.calls.append(('begin_tag', tag, props))
+        return
+
+    def end_tag(self):
+        self.calls.append(('end_tag',))
+        return
+
+    def do_tag(self, tag, props=None):
+        self.calls.append(('do_tag', tag, props))
+        return
+
+    def begin_figure(self, name, bbox, matrix):
+        self.calls.append(('begin_figure', name, bbox, matrix))
+        return
+
+    def end_figure(self, name):
+        self.calls.append(('end_figure', name))
+        return
+
+    def paint_path(self, graphicstate, stroke, fill, evenodd, path):
+        gstate = graphicstate.copy()
+        gstate.color = graphicstate.color
+        self.calls.append(('paint_path', gstate, stroke, fill, evenodd, list(path)))
+        return
+
+    def render_image(self, name, stream):
+        self.calls.append(('render_image', name, stream))
+        return
+
+    def render_string(self, textstate, seq):
+        linematrix = textstate.linematrix
+        end = self._ends.get(id(linematrix))
+        if end is not None and end[0] is linematrix:
+            after = end[1]
+        else:
+            after = None
+        self.calls.append(('render_string', textstate.copy(), seq, after))
+        # a new tuple, which stays there until the interpreter
+        # sets the position again.
+        linematrix = (linematrix[0], linematrix[1])
+        textstate.linematrix = linematrix
+        self._ends[id(linematrix)] = (linematrix, self.nstrings)
+        self.nstrings += 1
+        return
+
+    def replay(self, device, ctm):
+        ends = []
+        for call in self.calls:
+            name = call[0]
+            if name == 'set_ctm':
+                device.set_ctm(mult_matrix(call[1], ctm))
+            elif name == 'render_string':
+                (_, textstate, seq, after) = call
+                textstate = textstate.copy()
+                if after is not None:
+                    textstate.linematrix = ends[after]
+                device.render_string(textstate, seq)
+                ends.append(textstate.linematrix)
+            else:
+                getattr(device, name)(*call[1:])
+        return
+
+
 ##  TagExtractor
 ##
 class TagExtractor(PDFDevice):
@@ -2,6 +2,8 @@
 import sys
 import re
 import struct
+from bisect import bisect_right
+from collections import OrderedDict
 try:
     import hashlib as md5
 except ImportError:
@@ -17,7 +19,7 @@ from lc_pdftypes import str_value, list_value, dict_value, stream_value
 from lc_pdfparser import PDFSyntaxError
 from lc_pdfparser import PDFStreamParser
 from lc_arcfour import Arcfour
-from lc_utils import choplist, nunpack
+from lc_utils import choplist, nunpack_column, map_file
 from lc_utils import decode_text
 
 
@@ -57,6 +59,15 @@ class PDFBaseXRef(object):
     def get_objids(self):
         return []
 
+    def get_entries(self):
+        """Yields (objid, (strmid, index, genno)) of the objects."""
+        for objid in self.get_objids():
+            try:
+                yield (objid, self.get_pos(objid))
+            except KeyError:
+                pass
+        return
+
     # Must return
     #     (strmid, index, genno)
     #  or (None, pos, genno)
@@ -148,63 +159,157 @@ class PDFXRefFallback(PDFXRef):
     def __repr__(self):
         return '<PDFXRefFallback: offsets=%r>' % (self.offsets.keys())
 
-    PDFOBJ_CUE = re.compile(r'^(\d+)\s+(\d+)\s+obj\b')
+    # The file is searched for a few keywords instead of being read
+    # line by line: "N G obj" at the start of a line is found from
+    # its "obj", the data of a stream are skipped as the parser would
+    # skip them and only the objects that mention /ObjStm are parsed,
+    # to expand them. Everything stops at the first trailer. As for
+    # the parser, a stream starts with "stream" right after the
+    # dictionary, not anywhere (e.g. in a string).
+    KEYWORDS = re.compile(r'obj\b|>>[ \t\r\n\x0c\x00]*stream|trailer|/ObjStm\b')
+    PDFOBJ_CUE = re.compile(r'(?:^|(?<=[\r\n]))(\d+)[ \t\x0b\x0c]+(\d+)[ \t\x0b\x0c]+obj$')
+    PDFOBJ_WINDOW = 256
+    STREAM_EOL = re.compile(r'[ \t\x0c\x00]*(\r\n|[\r\n])')
+    STREAM_LENGTH = re.compile(r'/Length[ \t\r\n\x0c\x00]+(\d+)(?![ \t\r\n\x0c\x00]+\d+[ \t\r\n\x0c\x00]+R)')
 
     def load(self, parser, debug=0):
-        parser.seek(0)
+        (data, mapped) = self.get_buffer(parser)
+        try:
+            pos = self.find_objects(parser, data)
+        finally:
+            if mapped:
+                data.close()
+        if pos is not None:
+            parser.seek(pos)
+            self.load_trailer(parser)
+            if 1 <= debug:
+                print >>sys.stderr, 'trailer: %r' % self.get_trailer()
+        return
+
+    # get_buffer(parser)
+    #   Returns the whole file as a memory map or a string and
+    #   whether it is a new map that must be closed.
+    def get_buffer(self, parser):
+        if parser.mapped:
+            return (parser.fp, False)
+        data = map_file(parser.fp)
+        if data is not parser.fp:
+            return (data, True)
+        parser.fp.seek(0)
+        return (parser.fp.read(), False)
+
+    # find_objects(parser, data)
+    #   Records the objects of the file and returns
+    #   the position of the first trailer, if any.
+    def find_objects(self, parser, data):
+        # (pos, objid) of the object whose dictionary is being read.
+        current = expanded = None
+        pos = 0
         while 1:
-            try:
-                (pos, line) = parser.nextline()
-            except PSEOF:
-                break
-            if line.startswith('trailer'):
-                parser.seek(pos)
-                self.load_trailer(parser)
-                if 1 <= debug:
-                    print >>sys.stderr, 'trailer: %r' % self.get_trailer()
-                break
-            m = self.PDFOBJ_CUE.match(line)
+            m = self.KEYWORDS.search(data, pos)
             if not m:
+                return None
+            (i, pos) = m.span()
+            kwd = m.group(0)
+            if kwd == 'trailer':
+                if i == 0 or data[i-1] in '\r\n':
+                    return i
+            elif kwd == 'obj':
+                current = None
+                if data[max(0, i-3):i] == 'end':
+                    continue
+                m = self.PDFOBJ_CUE.search(data, max(0, i-self.PDFOBJ_WINDOW), pos)
+                if m:
+                    objid = int(m.group(1))
+                    self.offsets[objid] = (None, m.start(), int(m.group(2)))
+                    current = (m.start(), objid)
+            elif current is None:
                 continue
-            (objid, genno) = m.groups()
-            objid = int(objid)
-            genno = int(genno)
-            self.offsets[objid] = (None, pos, genno)
-            # expand ObjStm.
-            parser.seek(pos)
-            (_, obj) = parser.nextobject()
-            if isinstance(obj, PDFStream) and obj.get('Type') is LITERAL_OBJSTM:
-                stream = stream_value(obj)
-                try:
-                    n = stream['N']
-                except KeyError:
-                    if STRICT:
-                        raise PDFSyntaxError('N is not defined: %r' % stream)
-                    n = 0
-                parser1 = PDFStreamParser(stream.get_data())
-                objs = []
-                try:
-                    while 1:
-                        (_, obj) = parser1.nextobject()
-                        objs.append(obj)
-                except PSEOF:
-                    pass
-                n = min(n, len(objs)//2)
-                for index in xrange(n):
-                    objid1 = objs[index*2]
-                    self.offsets[objid1] = (objid, index, 0)
+            elif kwd.endswith('stream'):
+                m = self.STREAM_EOL.match(data, pos)
+                if m:
+                    pos = self.skip_stream(data, current[0], m.end())
+                    current = None
+            elif expanded is not current:
+                self.expand_objstm(parser, *current)
+                expanded = current
         return
 
+    # skip_stream(data, objpos, pos)
+    #   Returns the end of the data of a stream that starts at pos:
+    #   its /Length if the endstream keyword follows it, otherwise
+    #   the first endstream.
+    def skip_stream(self, data, objpos, pos):
+        m = self.STREAM_LENGTH.search(data, objpos, pos)
+        if m:
+            end = pos+int(m.group(1))
+            if data[end:end+12].lstrip('\r\n').startswith('endstream'):
+                return end
+        i = data.find('endstream', pos)
+        if i < 0:
+            return len(data)
+        return i+9
+
+    # expand_objstm(parser, pos, objid)
+    def expand_objstm(self, parser, pos, objid):
+        parser.seek(pos)
+        (_, obj) = parser.nextobject()
+        if isinstance(obj, PDFStream) and obj.get('Type') is LITERAL_OBJSTM:
+            stream = stream_value(obj)
+            try:
+                n = stream['N']
+            except KeyError:
+                if STRICT:
+                    raise PDFSyntaxError('N is not defined: %r' % stream)
+                n = 0
+            parser1 = PDFStreamParser(stream.get_data())
+            objs = [obj for (_, obj) in parser1.iterobjects()]
+            n = min(n, len(objs)//2)
+            for index in xrange(n):
+                objid1 = objs[index*2]
+                self.offsets[objid1] = (objid, index, 0)
+        return
+
+
+##  PDFXRefIndex
+##
+class PDFXRefIndex(PDFXRef):
+
+    """An xref section restored from an XRefIndex (see lc_xrefindex).
+
+    entries is a list of (objid, (strmid, index, genno)) in the order
+    of get_objids() of the original section.
+    """
+
+    def __init__(self, entries, trailer):
+        PDFXRef.__init__(self)
+        self.objids = [objid for (objid, _) in entries]
+        self.offsets.update(entries)
+        self.trailer.update(trailer)
+        return
+
+    def __repr__(self):
+        return '<PDFXRefIndex: offsets=%r>' % (self.offsets.keys())
+
+    def get_objids(self):
+        return iter(self.objids)
+
 
 ##  PDFXRefStream
 ##
 class PDFXRefStream(PDFBaseXRef):
 
     def __init__(self):
-        self.data = None
         self.entlen = None
         self.fl1 = self.fl2 = self.fl3 = None
         self.ranges = []
+        # the fields of the entries are decoded once into columns.
+        self.nentries = 0
+        self.types = self.fields2 = self.fields3 = None
+        # (start, end, the entry of start) of each subsection, and
+        # their starts if they are sorted so that bisect can be used.
+        self.subsections = []
+        self.starts = None
         return
 
     def __repr__(self):
@@ -223,52 +328,153 @@ class PDFXRefStream(PDFBaseXRef):
             raise PDFSyntaxError('Invalid index number')
         self.ranges.extend(choplist(2, index_array))
         (self.fl1, self.fl2, self.fl3) = stream['W']
-        self.data = stream.get_data()
+        data = stream.get_data()
         self.entlen = self.fl1+self.fl2+self.fl3
         self.trailer = stream.attrs
+        self.decode_entries(data)
         if 1 <= debug:
             print >>sys.stderr, ('xref stream: objid=%s, fields=%d,%d,%d' %
                                  (', '.join(map(repr, self.ranges)),
                                  self.fl1, self.fl2, self.fl3))
         return
 
+    # decode_entries(data)
+    def decode_entries(self, data):
+        if self.entlen:
+            self.nentries = len(data) // self.entlen
+        n = self.nentries
+        self.types = nunpack_column(data, 0, self.fl1, self.entlen, n, 1)
+        self.fields2 = nunpack_column(data, self.fl1, self.fl2, self.entlen, n)
+        self.fields3 = nunpack_column(data, self.fl1+self.fl2, self.fl3, self.entlen, n)
+        index = 0
+        for (start, nobjs) in self.ranges:
+            self.subsections.append((start, start+nobjs, index))
+            index += nobjs
+        if all(end0 <= start1 for ((_, end0, _), (start1, _, _))
+               in zip(self.subsections, self.subsections[1:])):
+            self.starts = [start for (start, _, _) in self.subsections]
+        return
+
+    # get_entry(objid)
+    #   Returns the index of the entry of an object.
+    def get_entry(self, objid):
+        if self.starts is not None:
+            i = bisect_right(self.starts, objid)-1
+            if 0 <= i:
+                (start, end, index) = self.subsections[i]
+                if objid < end:
+                    return index+objid-start
+        else:
+            for (start, end, index) in self.subsections:
+                if start <= objid and objid < end:
+                    return index+objid-start
+        raise KeyError(objid)
+
     def get_trailer(self):
         return self.trailer
 
     def get_objids(self):
-        for (start, nobjs) in self.ranges:
-            for i in xrange(nobjs):
-                offset = self.entlen * i
-                ent = self.data[offset:offset+self.entlen]
-                f1 = nunpack(ent[:self.fl1], 1)
-                if f1 == 1 or f1 == 2:
-                    yield start+i
+        types = self.types
+        for (start, end, index) in self.subsections:
+            for i in xrange(index, min(index+end-start, self.nentries)):
+                if types[i] == 1 or types[i] == 2:
+                    yield start+i-index
         return
 
     def get_pos(self, objid):
-        index = 0
-        for (start, nobjs) in self.ranges:
-            if start <= objid and objid < start+nobjs:
-                index += objid - start
-                break
-            else:
-                index += nobjs
-        else:
+        i = self.get_entry(objid)
+        if self.nentries <= i:
             raise KeyError(objid)
-        offset = self.entlen * index
-        ent = self.data[offset:offset+self.entlen]
-        f1 = nunpack(ent[:self.fl1], 1)
-        f2 = nunpack(ent[self.fl1:self.fl1+self.fl2])
-        f3 = nunpack(ent[self.fl1+self.fl2:])
+        f1 = self.types[i]
         if f1 == 1:
-            return (None, f2, f3)
+            return (None, self.fields2[i], self.fields3[i])
         elif f1 == 2:
-            return (f2, f3, 0)
+            return (self.fields2[i], self.fields3[i], 0)
         else:
             # this is a free object
             raise KeyError(objid)
 
 
+##  PDFObjectCache
+##
+class PDFObjectCache(object):
+
+    """The objects that a PDFDocument has read, by objid.
+
+    With max_bytes, the streams are kept within that many bytes of
+    data: the least recently used ones are evicted, and read again
+    from the file when they are needed. The other objects are small
+    and always kept. A stream is usually decoded right after it is
+    read, so the sizes of the streams that were used are only taken
+    when the next object is added.
+
+    An evicted stream is only freed if nothing else holds it: the
+    forms that an interpreter recorded and the fonts and resources
+    of the resource manager keep theirs, so the memory taken by the
+    streams can be larger than max_bytes.
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.objs = {}
+        # {objid: size} of the streams, least recently used first.
+        self.streams = OrderedDict()
+        self.nbytes = 0
+        self.used = set()
+        self.hits = self.misses = self.evictions = 0
+        return
+
+    def __repr__(self):
+        return ('<PDFObjectCache: objs=%d, streams=%d, bytes=%d, hits=%d, misses=%d, evictions=%d>' %
+                (len(self.objs), len(self.streams), self.nbytes,
+                 self.hits, self.misses, self.evictions))
+
+    def get(self, objid):
+        """Returns (obj, genno) or None."""
+        entry = self.objs.get(objid)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if objid in self.streams:
+            self.streams[objid] = self.streams.pop(objid)
+            self.used.add(objid)
+        return entry
+
+    def put(self, objid, obj, genno):
+        self.objs[objid] = (obj, genno)
+        if self.max_bytes and isinstance(obj, PDFStream):
+            self.streams[objid] = 0
+            self.used.add(objid)
+            self.evict()
+        return
+
+    # stream_size(stream)
+    def stream_size(self, stream):
+        if stream.data is not None:
+            return len(stream.data)
+        if stream.rawdata is not None:
+            return len(stream.rawdata)
+        return 0
+
+    # evict()
+    #   Takes the sizes of the streams that were used and evicts
+    #   the oldest ones while there are too many bytes.
+    def evict(self):
+        for objid in self.used:
+            if objid in self.streams:
+                size = self.stream_size(self.objs[objid][0])
+                self.nbytes += size-self.streams[objid]
+                self.streams[objid] = size
+        self.used.clear()
+        while self.max_bytes < self.nbytes:
+            (objid, size) = self.streams.popitem(last=False)
+            del self.objs[objid]
+            self.nbytes -= size
+            self.evictions += 1
+        return
+
+
 ##  PDFDocument
 ##
 class PDFDocument(object):
@@ -283,12 +489,18 @@ class PDFDocument(object):
       doc = PDFDocument(parser, password)
       obj = doc.getobj(objid)
 
+    With an XRefIndex as index, the xrefs are taken from the index
+    if it is valid, otherwise they are read and the index is written.
+    With max_cache_bytes, the document keeps its decoded streams
+    within about that many bytes, apart from those that are still
+    used elsewhere (see PDFObjectCache).
     """
 
     debug = 0
     PASSWORD_PADDING = '(\xbfN^Nu\x8aAd\x00NV\xff\xfa\x01\x08..\x00\xb6\xd0h>\x80/\x0c\xa9\xfedSiz'
 
-    def __init__(self, parser, password='', caching=True, fallback=True):
+    def __init__(self, parser, password='', caching=True, fallback=True, index=None,
+                 max_cache_bytes=0):
         "Set the document to use a given PDFParser object."
         self.caching = caching
         self.xrefs = []
@@ -297,23 +509,25 @@ class PDFDocument(object):
         self.encryption = None
         self.decipher = None
         self._parser = None
-        self._cached_objs = {}
+        self.cache = PDFObjectCache(max_cache_bytes)
+        # {objid: (objs, n)} of the object streams that were parsed.
+        # An object stream has no streams in it, only the small
+        # objects that the cache always keeps, so it is not bounded.
         self._parsed_objs = {}
+        # (number of xrefs, {objid: (xref number, position)}).
+        self._xref_table = (0, {})
         self._parser = parser
         self._parser.set_document(self)
         self.is_printable = self.is_modifiable = self.is_extractable = True
-        # Retrieve the information of each header that was appended
-        # (maybe multiple times) at the end of the document.
-        try:
-            pos = self.find_xref(parser)
-            self.read_xref_from(parser, pos, self.xrefs)
-        except PDFNoValidXRef:
-            fallback = True
-        if fallback:
-            parser.fallback = True
-            xref = PDFXRefFallback()
-            xref.load(parser)
-            self.xrefs.append(xref)
+        indexed = None
+        if index is not None:
+            indexed = index.load(self)
+        if indexed is not None:
+            (self.xrefs, parser.fallback) = indexed
+        else:
+            self.read_xrefs(parser, fallback)
+            if index is not None:
+                index.save(self.xrefs, parser.fallback)
         for xref in self.xrefs:
             trailer = xref.get_trailer()
             if not trailer:
@@ -337,6 +551,22 @@ class PDFDocument(object):
                 raise PDFSyntaxError('Catalog not found!')
         return
 
+    # read_xrefs(parser, fallback)
+    def read_xrefs(self, parser, fallback):
+        # Retrieve the information of each header that was appended
+        # (maybe multiple times) at the end of the document.
+        try:
+            pos = self.find_xref(parser)
+            self.read_xref_from(parser, pos, self.xrefs)
+        except PDFNoValidXRef:
+            fallback = True
+        if fallback:
+            parser.fallback = True
+            xref = PDFXRefFallback()
+            xref.load(parser)
+            self.xrefs.append(xref)
+        return
+
     # _initialize_password(password='')
     #   Perform the initialization with a given password.
     def _initialize_password(self, password=''):
@@ -424,13 +654,7 @@ class PDFDocument(object):
             n = 0
         parser = PDFStreamParser(stream.get_data())
         parser.set_document(self)
-        objs = []
-        try:
-            while 1:
-                (_, obj) = parser.nextobject()
-                objs.append(obj)
-        except PSEOF:
-            pass
+        objs = [obj for (_, obj) in parser.iterobjects()]
         return (objs, n)
 
     KEYWORD_OBJ = KWD('obj')
@@ -447,6 +671,31 @@ class PDFDocument(object):
         (_, obj) = self._parser.nextobject()
         return obj
 
+    # get_positions(objid)
+    #   Yields the positions of an object in the order they are
+    #   tried: the first xref that has the object is found in a
+    #   table of all the xrefs, the following ones are only looked
+    #   at if the object cannot be read from there.
+    def get_positions(self, objid):
+        (nxrefs, table) = self._xref_table
+        if nxrefs != len(self.xrefs):
+            table = {}
+            for i in xrange(len(self.xrefs)-1, -1, -1):
+                for (objid1, pos) in self.xrefs[i].get_entries():
+                    table[objid1] = (i, pos)
+            self._xref_table = (len(self.xrefs), table)
+        try:
+            (i, pos) = table[objid]
+        except KeyError:
+            return
+        yield pos
+        for xref in self.xrefs[i+1:]:
+            try:
+                yield xref.get_pos(objid)
+            except KeyError:
+                continue
+        return
+
     # can raise PDFObjectNotFound
     def getobj(self, objid):
         assert objid != 0
@@ -454,14 +703,13 @@ class PDFDocument(object):
             raise PDFException('PDFDocument is not initialized')
         if 2 <= self.debug:
             print >>sys.stderr, 'getobj: objid=%r' % (objid)
-        if objid in self._cached_objs:
-            (obj, genno) = self._cached_objs[objid]
+        entry = None
+        if self.caching:
+            entry = self.cache.get(objid)
+        if entry is not None:
+            (obj, genno) = entry
         else:
-            for xref in self.xrefs:
-                try:
-                    (strmid, index, genno) = xref.get_pos(objid)
-                except KeyError:
-                    continue
+            for (strmid, index, genno) in self.get_positions(objid):
                 try:
                     if strmid is not None:
                         stream = stream_value(self.getobj(strmid))
@@ -478,7 +726,7 @@ class PDFDocument(object):
             if 2 <= self.debug:
                 print >>sys.stderr, 'register: objid=%r: %r' % (objid, obj)
             if self.caching:
-                self._cached_objs[objid] = (obj, genno)
+                self.cache.put(objid, obj, genno)
         if self.decipher:
             obj = decipher_all(self.decipher, objid, genno, obj)
         return obj
@@ -597,3 +845,36 @@ class PDFDocument(object):
             pos = int_value(trailer['Prev'])
             self.read_xref_from(parser, pos, xrefs)
         return
+
+
+import unittest
+
+
+##  Simplistic Test cases
+##
+class TestPDFXRefFallback(unittest.TestCase):
+
+    # the xref is broken and the title of object 3 ends a line
+    # with "stream".
+    TESTDATA = ('%PDF-1.4\n'
+                '1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n'
+                '2 0 obj\n<< /Type /Pages /Kids [] /Count 0 >>\nendobj\n'
+                '3 0 obj\n<< /Title (a data stream\n) >>\nendobj\n'
+                '4 0 obj\n<< /Length 6 >>\nstream\n4 0 obj\nendstream\nendobj\n'
+                '5 0 obj\n<< /Type /Font >>\nendobj\n'
+                'trailer\n<< /Size 6 /Root 1 0 R /Info 3 0 R >>\n'
+                'startxref\n9999\n%%EOF\n')
+
+    def test_1(self):
+        from StringIO import StringIO
+        from lc_pdfparser import PDFParser
+        parser = PDFParser(StringIO(self.TESTDATA))
+        xref = PDFXRefFallback()
+        xref.load(parser)
+        self.assertEqual(sorted(xref.get_objids()), [1, 2, 3, 4, 5])
+        self.assertEqual(xref.get_pos(5), (None, self.TESTDATA.index('5 0 obj'), 0))
+        self.assertEqual(xref.get_trailer()['Size'], 6)
+        return
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,21 @@
 #!/usr/bin/env python
 import sys
 import os
-from lc_pdfdocument import PDFDocument
+import os.path
+import signal
+from pdfminer.lc_pdfdocument import PDFDocument
 from pdfminer.lc_pdfparser import PDFParser
 from pdfminer.lc_pdfinterp import PDFResourceManager, PDFPageInterpreter
-from pdfminer.lc_pdfdevice import PDFDevice, TagExtractor
-from pdfminer.lc_pdfpage import PDFPage
-from pdfminer.lc_converter import XMLConverter, HTMLConverter, TextConverter
+from pdfminer.lc_pdfdevice import PDFDevice
 from pdfminer.lc_cmapdb import CMapDB
 from pdfminer.lc_layout import LAParams
-from pdfminer.lc_image import ImageWriter
+from pdfminer.lc_batch import make_jobs, run_batch, watch_batch
+from pdfminer.lc_manifest import BatchManifest
+from pdfminer.lc_journal import BatchJournal
+from pdfminer.lc_watchdog import Watchdog
+from pdfminer.lc_prefork import warm_up
+from pdfminer.lc_watch import FolderWatcher
+from pdfminer.lc_xrefindex import XRefIndex
 
 __author__ = 'viveklal'
 
@@ -17,11 +23,18 @@ __author__ = 'viveklal'
 def main(argv):
     import getopt
     def usage():
-        print ('usage: %s [-i input folder] [-o output folder]'
-                % argv[0])
+        print ('usage: %s [-d] [-f] [-j processes] [--resume] [-t seconds] [-m megabytes]'
+               ' [-q quarantine folder] [-w cmap,...] [--schedule=size|pages] [--dry-run]'
+               ' [--watch] [--settle=seconds] [--max-inflight=files] [--mmap] [--text-only]'
+               ' [--images=all|bbox|none] [--ocr-words] [--xref-cache=folder]'
+               ' [--max-cache=megabytes]'
+               ' [-i input folder] [-o output folder]' % argv[0])
         return 100
     try:
-        (opts, args) = getopt.getopt(argv[1:], 'i:o:')
+        (opts, args) = getopt.getopt(argv[1:], 'dfi:o:j:t:m:q:w:', ['resume', 'schedule=', 'dry-run', 'watch', 'settle=',
+                                                                'max-inflight=', 'mmap', 'text-only',
+                                                                'images=', 'ocr-words', 'xref-cache=',
+                                                                'max-cache='])
     except getopt.GetoptError:
         return usage()
 
@@ -29,67 +42,117 @@ def main(argv):
     debug = 0
     # input option
     password = ''
-    pagenos = set()
-    maxpages = 0
+    input_folder = None
     # output option
-    outfile = None
-    outtype = None
-    imagewriter = None
+    output_folder = None
     rotation = 0
-    layoutmode = 'normal'
     codec = 'utf-8'
-    pageno = 1
-    scale = 1
     caching = True
-    showpageno = True
+    processes = 1
+    force = False
+    resume = False
+    timeout = 0
+    maxrss = 0
+    quarantine = None
+    cmapnames = []
+    schedule = 'size'
+    dry_run = False
+    watch = False
+    settle = 5.0
+    maxinflight = None
+    mapped = False
+    text_only = False
+    imagemode = 'all'
+    xrefcache = None
+    max_cache_bytes = 0
     laparams = LAParams()
 
+    for (k, v) in opts:
+        if k == '-d': debug += 1
+        elif k == '-i': input_folder = v
+        elif k == '-o': output_folder = v
+        elif k == '-j': processes = int(v)
+        elif k == '-f': force = True
+        elif k == '--resume': resume = True
+        elif k == '--schedule': schedule = v
+        elif k == '--dry-run': dry_run = True
+        elif k == '--watch': watch = True
+        elif k == '--settle': settle = float(v)
+        elif k == '--max-inflight': maxinflight = int(v)
+        elif k == '--mmap': mapped = True
+        elif k == '--text-only': text_only = True
+        elif k == '--images': imagemode = v
+        elif k == '--ocr-words': laparams.ocr_words = True
+        elif k == '--xref-cache': xrefcache = v
+        elif k == '--max-cache': max_cache_bytes = int(v)*1024*1024
+        elif k == '-t': timeout = float(v)
+        elif k == '-m': maxrss = int(v)*1024*1024
+        elif k == '-q': quarantine = v
+        elif k == '-w': cmapnames.extend(v.split(','))
+    if not input_folder or not output_folder or processes < 1:
+        return usage()
+    if schedule not in ('pages', 'size'):
+        return usage()
+    if imagemode not in ('all', 'bbox', 'none'):
+        return usage()
+
     PDFDocument.debug = debug
     PDFParser.debug = debug
     CMapDB.debug = debug
     PDFResourceManager.debug = debug
     PDFPageInterpreter.debug = debug
     PDFDevice.debug = debug
+    BatchManifest.debug = debug
+    Watchdog.debug = debug
+    FolderWatcher.debug = debug
+    XRefIndex.debug = debug
+    # the workers are forked with the CMaps already loaded.
+    for name in warm_up(cmapnames, debug=debug):
+        print >>sys.stderr, 'warning: CMap not found: %s' % name
     #
-    rsrcmgr = PDFResourceManager(caching=caching)
-
-    outtype = 'xml'
-
-
-    for (k, v) in opts:
-        if k == '-i': input_folder = v
-        elif k == '-o': output_folder = v
-
-    pdf_files = os.listdir(input_folder)
-
-    for pdf_file in pdf_files :
-
-
-
-        print 'PDF file name is -', pdf_file
-
-
-        pdf_file_full_path = os.path.join(input_folder, pdf_file)
-
-        outfile = output_folder + os.path.splitext(os.path.basename(pdf_file))[0] + '.xml'
-
-        print 'Extracted output filename is -', outfile
-
-        if outfile:
-            outfp = file(outfile, 'w')
-        else:
-            outfp = sys.stdout
-        device = XMLConverter(rsrcmgr, outfp, codec=codec, laparams=laparams,
-                              imagewriter=imagewriter)
-        fp = file(pdf_file_full_path, 'rb')
-        interpreter = PDFPageInterpreter(rsrcmgr, device)
-        for page in PDFPage.get_pages(fp, pagenos,
-                                      maxpages=maxpages, password=password,
-                                      caching=caching, check_extractable=True):
-            page.rotate = (page.rotate+rotation) % 360
-            interpreter.process_page(page)
-        fp.close()
-        outfp.close()
+    if (timeout or maxrss) and quarantine is None:
+        quarantine = os.path.join(output_folder, 'quarantine')
+    if watch:
+        manifest = BatchManifest(output_folder)
+        if force:
+            manifest.entries.clear()
+        def stop(signum, frame):
+            raise KeyboardInterrupt
+        signal.signal(signal.SIGTERM, stop)
+        print >>sys.stderr, 'watching %s' % input_folder
+        summary = watch_batch(input_folder, output_folder, processes=processes,
+                              maxinflight=maxinflight, manifest=manifest,
+                              journal=BatchJournal(output_folder), timeout=timeout,
+                              maxrss=maxrss, quarantine=quarantine, settle=settle,
+                              laparams=laparams, codec=codec, password=password,
+                              caching=caching, rotation=rotation, mapped=mapped,
+                              text_only=text_only, imagemode=imagemode,
+                              xrefcache=xrefcache, max_cache_bytes=max_cache_bytes,
+                              debug=debug)
+        summary.write(sys.stderr)
+        return
+    jobs = make_jobs(input_folder, output_folder, laparams=laparams,
+                     codec=codec, password=password, caching=caching,
+                     rotation=rotation, mapped=mapped, text_only=text_only,
+                     imagemode=imagemode, xrefcache=xrefcache,
+                     max_cache_bytes=max_cache_bytes)
+    for job in jobs:
+        print 'PDF file name is -', job.name
+        print 'Extracted output filename is -', job.xml_path
+    # -f reconverts every file, but the manifest is still rewritten.
+    manifest = BatchManifest(output_folder)
+    if force:
+        manifest.entries.clear()
+    journal = BatchJournal(output_folder)
+    summary = run_batch(jobs, processes=processes, manifest=manifest,
+                        journal=journal, resume=resume, timeout=timeout,
+                        maxrss=maxrss, quarantine=quarantine, schedule=schedule,
+                        dry_run=dry_run, debug=debug)
+    if dry_run:
+        return
+    summary.write(sys.stderr)
+    if summary.failed or summary.quarantined:
+        return 1
     return
 
-if __name__ == '__main__': sys.exit(main(sys.argv))
\ No newline at end of file
+if __name__ == '__main__': sys.exit(main(sys.argv))
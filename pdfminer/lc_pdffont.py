@@ -8,7 +8,6 @@ except ImportError:
 from lc_cmapdb import CMapDB, CMapParser, FileUnicodeMap, CMap
 from lc_encodingdb import EncodingDB, name2unicode
 from lc_psparser import PSStackParser
-from lc_psparser import PSEOF
 from lc_psparser import LIT, KWD, STRICT
 from lc_psparser import PSLiteral, literal_name
 from lc_pdftypes import PDFException, resolve1
@@ -93,11 +92,7 @@ class Type1FontHeaderParser(PSStackParser):
         return
 
     def get_encoding(self):
-        while 1:
-            try:
-                (cid, name) = self.nextobject()
-            except PSEOF:
-                break
+        for (cid, name) in self.iterobjects():
             try:
                 self._cid2unicode[cid] = name2unicode(name)
             except KeyError:
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import sys
 import re
+import traceback
 try:
     from cStringIO import StringIO
 except ImportError:
@@ -20,6 +21,7 @@ from lc_pdfcolor import PDFColorSpace
 from lc_pdfcolor import PREDEFINED_COLORSPACE
 from lc_pdfcolor import LITERAL_DEVICE_GRAY, LITERAL_DEVICE_RGB
 from lc_pdfcolor import LITERAL_DEVICE_CMYK
+from lc_pdfdevice import PDFRecorder
 from lc_utils import choplist
 from lc_utils import mult_matrix, MATRIX_IDENTITY
 
@@ -42,6 +44,12 @@ LITERAL_FORM = LIT('Form')
 LITERAL_IMAGE = LIT('Image')
 DEFAULT_TEXT_COLOR_BLACK ='#000000'
 
+# the target of get_inline_data() ends the data if a whitespace
+# or the end of the stream follows it.
+INLINE_DATA_DELIMITER = r'(?=[ \t\n\r\x0b\x0c]|\Z)'
+INLINE_DATA_END = re.compile(r'EI' + INLINE_DATA_DELIMITER)
+INLINE_DATA_EOL = re.compile(r'(\x0d\x0a|[\x0d\x0a])$')
+
 
 ##  PDFTextState
 ##
@@ -140,6 +148,46 @@ class PDFResourceManager(object):
     def __init__(self, caching=True):
         self.caching = caching
         self._cached_fonts = {}
+        # {id(resources): (resources, (fontmap, xobjmap, csmap))}
+        # of the pages of _resources_doc.
+        self._cached_resources = {}
+        self._resources_doc = None
+        self.resources_hits = 0
+        self.resources_misses = 0
+        return
+
+    def __repr__(self):
+        return ('<PDFResourceManager: fonts=%d, resources=%d, hits=%d, misses=%d>' %
+                (len(self._cached_fonts), len(self._cached_resources),
+                 self.resources_hits, self.resources_misses))
+
+    # begin_document(doc)
+    #   The resources are only kept for the document of the pages
+    #   being processed: they refer to its objects and would keep
+    #   every document of a long-lived manager in memory.
+    def begin_document(self, doc):
+        if doc is not self._resources_doc:
+            self._cached_resources.clear()
+            self._resources_doc = doc
+        return
+
+    # get_resources(resources)
+    #   Returns the (fontmap, xobjmap, csmap) made from the same
+    #   resource dictionary, or None. Pages usually inherit one
+    #   /Resources object, which the document gives back as the
+    #   same dictionary.
+    def get_resources(self, resources):
+        entry = self._cached_resources.get(id(resources))
+        if entry is not None and entry[0] is resources:
+            self.resources_hits += 1
+            return entry[1]
+        self.resources_misses += 1
+        return None
+
+    def set_resources(self, resources, maps):
+        if self.caching:
+            # the dictionary is kept so that its id is not reused.
+            self._cached_resources[id(resources)] = (resources, maps)
         return
 
     def get_procset(self, procs):
@@ -211,6 +259,11 @@ class PDFResourceManager(object):
 ##
 class PDFContentParser(PSStackParser):
 
+    # a content stream is read as a whole and tokenized in bulk;
+    # the binary data of an inline image follow its ID keyword.
+    bulk = True
+    bulk_stop = (KWD('ID'),)
+
     def __init__(self, streams):
         self.streams = streams
         self.istream = 0
@@ -238,41 +291,37 @@ class PDFContentParser(PSStackParser):
         while 1:
             self.fillfp()
             self.bufpos = self.fp.tell()
-            self.buf = self.fp.read(self.BUFSIZ)
+            self.buf = self.fp.read()
             if self.buf:
                 break
             self.fp = None
         self.charpos = 0
         return
 
+    # get_inline_data(pos, target='EI')
+    #   Returns the data of an inline image from pos up to the target
+    #   keyword that is followed by a whitespace (which is skipped) or
+    #   ends the stream. An end of line right before the target is
+    #   not part of the data.
     def get_inline_data(self, pos, target='EI'):
+        if target == 'EI':
+            end = INLINE_DATA_END
+        else:
+            end = re.compile(re.escape(target) + INLINE_DATA_DELIMITER)
         self.seek(pos)
-        i = 0
         data = ''
-        while i <= len(target):
+        while 1:
             self.fillbuf()
-            if i:
-                c = self.buf[self.charpos]
-                data += c
-                self.charpos += 1
-                if len(target) <= i and c.isspace():
-                    i += 1
-                elif i < len(target) and c == target[i]:
-                    i += 1
-                else:
-                    i = 0
-            else:
-                try:
-                    j = self.buf.index(target[0], self.charpos)
-                    #print 'found', (0, self.buf[j:j+10])
-                    data += self.buf[self.charpos:j+1]
-                    self.charpos = j+1
-                    i = 1
-                except ValueError:
-                    data += self.buf[self.charpos:]
-                    self.charpos = len(self.buf)
-        data = data[:-(len(target)+1)]  # strip the last part
-        data = re.sub(r'(\x0d\x0a|[\x0d\x0a])$', '', data)
+            m = end.search(self.buf, self.charpos)
+            if m:
+                break
+            # the data go on in the next stream.
+            data += self.buf[self.charpos:]
+            self.charpos = len(self.buf)
+        data += self.buf[self.charpos:m.start()]
+        self.charpos = min(m.end()+1, len(self.buf))
+        # the end of line can only be in the last few bytes.
+        data = data[:-4] + INLINE_DATA_EOL.sub('', data[-4:])
         return (pos, data)
 
     def flush(self):
@@ -311,18 +360,77 @@ class PDFPageInterpreter(object):
 
     debug = 0
 
-    def __init__(self, rsrcmgr, device):
+    # the operators whose operands are popped but that do nothing.
+    ignored_operators = ()
+    # the operators that take any number of operands.
+    varargs_operators = ('SC', 'sc', 'SCN', 'scn')
+
+    def __init__(self, rsrcmgr, device, imagemode='all'):
         self.rsrcmgr = rsrcmgr
         self.device = device
+        # 'all': images are passed to the device, 'bbox': only their
+        # placement is, 'none': they are ignored.
+        self.imagemode = imagemode
+        # {objid: (form xobject, PDFRecorder)}, shared with dup().
+        self.forms = {}
+        # {keyword: (bound handler, nargs)}
+        self.operators = dict((kwd, (getattr(self, name), nargs))
+                              for (kwd, (name, nargs)) in self.get_operator_table().iteritems())
+        return
+
+    def dup(self, device=None):
+        if device is None:
+            device = self.device
+        interpreter = self.__class__(self.rsrcmgr, device, imagemode=self.imagemode)
+        interpreter.forms = self.forms
+        return interpreter
+
+    # get_operator_table()
+    #   Maps the keyword of each operator to the name of its
+    #   do_* method and its number of arguments. The table is
+    #   made once for each class.
+    @classmethod
+    def get_operator_table(klass):
+        table = klass.__dict__.get('_operator_table')
+        if table is None:
+            table = {}
+            for name in dir(klass):
+                if not name.startswith('do_'):
+                    continue
+                # do_T_a is T*, do__w is " and do__q is '.
+                opname = name[3:].replace('_a', '*').replace('_w', '"').replace('_q', "'")
+                nargs = getattr(klass, name).func_code.co_argcount-1
+                table[KWD(opname)] = (name, nargs)
+            for opname in klass.ignored_operators:
+                (_, nargs) = table[KWD(opname)]
+                if opname in klass.varargs_operators:
+                    table[KWD(opname)] = ('skip_operands', 0)
+                else:
+                    table[KWD(opname)] = ('skip_operator', nargs)
+            klass._operator_table = table
+        return table
+
+    def skip_operator(self, *args):
         return
 
-    def dup(self):
-        return self.__class__(self.rsrcmgr, self.device)
+    # skip_operands()
+    #   The operands of an operator that takes any number of them
+    #   are all dropped.
+    def skip_operands(self):
+        self.argstack = []
+        return
 
     # init_resources(resources):
     #   Prepare the fonts and XObjects listed in the Resource attribute.
+    #   The maps are only read afterwards, so they are shared by
+    #   all the pages and forms that use the same resources.
     def init_resources(self, resources):
         self.resources = resources
+        if resources:
+            maps = self.rsrcmgr.get_resources(resources)
+            if maps is not None:
+                (self.fontmap, self.xobjmap, self.csmap) = maps
+                return
         self.fontmap = {}
         self.xobjmap = {}
         self.csmap = PREDEFINED_COLORSPACE.copy()
@@ -358,6 +466,7 @@ class PDFPageInterpreter(object):
             elif k == 'XObject':
                 for (xobjid, xobjstrm) in dict_value(v).iteritems():
                     self.xobjmap[xobjid] = xobjstrm
+        self.rsrcmgr.set_resources(resources, (self.fontmap, self.xobjmap, self.csmap))
         return
 
     # init_state(ctm)
@@ -562,68 +671,22 @@ class PDFPageInterpreter(object):
         return
 
     # setcolorspace-stroking
+    #   The color itself is set by the operands of SC or SCN.
     def do_CS(self, name):
         try:
             self.scs = self.csmap[literal_name(name)]
-            if self.scs:
-                n = self.scs.ncomponents
-                if not self.argstack == []:
-                    if n == 4:
-                        if len(self.argstack == 1):
-                            col = self.pop(1)
-                        elif len(self.argstack) == 4:
-                            (c,m,y,k) =self.pop(4)
-                            self.do_K(c,m,y,k)
-                    elif n == 3:
-                        if len(self.argstack) == 1:
-                            col = self.pop(1)
-                        elif len(self.argstack) == 3:
-                            (r,g,b) = self.pop(3)
-                            self.do_RG(r,g,b)
-                    elif n == 1:
-                        g = self.pop(1)
-                        self.do_G(g)
-                else:
-                    print 'pdfinterp.py do_CS method - returning without finding color since stream stack contains improper values'
-                    pass
-
         except KeyError:
             if STRICT:
                 raise PDFInterpreterError('Undefined ColorSpace: %r' % name)
-            n = 1
-
         return
 
-    # setcolorspace-non-strokine
+    # setcolorspace-non-stroking
     def do_cs(self, name):
         try:
             self.ncs = self.csmap[literal_name(name)]
-            if self.ncs:
-                n = self.ncs.ncomponents
-                if not self.argstack == []:
-                    if n == 4:
-                        if len(self.argstack) == 1:
-                            col = self.pop(1)
-                        else:
-                            (c,m,y,k) = self.pop(4)
-                            self.do_k(c,m,y,k)
-                    elif n == 3:
-                        if len(self.argstack) == 1:
-                            col = self.pop(1)
-                            (r,g,b) = (col[0],col[0], col[0])
-                        elif len(self.argstack == 3):
-                            (r,g,b) = self.pop(3)
-                            self.do_rg(r,g,b)
-                    elif n == 1:
-                        g = self.pop(1)
-                        self.do_g(g)
-                else:
-                    print 'pdfinterp.py do_cs method line no. 620: returning without finding color since stream stack contains improper values'
-                    pass
         except KeyError:
             if STRICT:
                 raise PDFInterpreterError('Undefined ColorSpace: %r' % name)
-            n = 1
         return
 
     # setgray-stroking
@@ -906,12 +969,38 @@ class PDFPageInterpreter(object):
 
     def do_EI(self, obj):
         if 'W' in obj and 'H' in obj:
-            iobjid = str(id(obj))
-            self.device.begin_figure(iobjid, (0, 0, 1, 1), MATRIX_IDENTITY)
-            self.device.render_image(iobjid, obj)
-            self.device.end_figure(iobjid)
+            self.render_image(str(id(obj)), obj)
         return
 
+    # render_image(name, stream)
+    #   Places an image as a figure of the unit square. With imagemode
+    #   'bbox' the device gets no stream, so the image data are never
+    #   decoded; with 'none' the image is dropped.
+    def render_image(self, name, stream):
+        if self.imagemode == 'none':
+            return
+        if self.imagemode == 'bbox':
+            stream = None
+        self.device.begin_figure(name, (0, 0, 1, 1), MATRIX_IDENTITY)
+        self.device.render_image(name, stream)
+        self.device.end_figure(name)
+        return
+
+    # get_form(xobj, resources)
+    #   Returns the recording of a form XObject. A form that has its
+    #   own resources starts from the same state wherever it is used
+    #   but for the CTM, so it is interpreted once and its recording
+    #   is kept as long as the document returns the same object.
+    def get_form(self, xobj, resources):
+        form = self.forms.get(xobj.objid)
+        if form is not None and form[0] is xobj:
+            return form[1]
+        recorder = PDFRecorder(self.rsrcmgr)
+        self.dup(recorder).render_contents(resources, [xobj])
+        if xobj.objid is not None:
+            self.forms[xobj.objid] = (xobj, recorder)
+        return recorder
+
     # invoke an XObject
     def do_Do(self, xobjid):
         xobjid = literal_name(xobjid)
@@ -925,20 +1014,22 @@ class PDFPageInterpreter(object):
             print >>sys.stderr, 'Processing xobj: %r' % xobj
         subtype = xobj.get('Subtype')
         if subtype is LITERAL_FORM and 'BBox' in xobj:
-            interpreter = self.dup()
             bbox = list_value(xobj['BBox'])
             matrix = list_value(xobj.get('Matrix', MATRIX_IDENTITY))
+            ctm = mult_matrix(matrix, self.ctm)
             # According to PDF reference 1.7 section 4.9.1, XObjects in
             # earlier PDFs (prior to v1.2) use the page's Resources entry
             # instead of having their own Resources entry.
-            resources = dict_value(xobj.get('Resources')) or self.resources.copy()
+            resources = dict_value(xobj.get('Resources'))
             self.device.begin_figure(xobjid, bbox, matrix)
-            interpreter.render_contents(resources, [xobj], ctm=mult_matrix(matrix, self.ctm))
+            if resources:
+                self.get_form(xobj, resources).replay(self.device, ctm)
+            else:
+                interpreter = self.dup()
+                interpreter.render_contents(self.resources, [xobj], ctm=ctm)
             self.device.end_figure(xobjid)
         elif subtype is LITERAL_IMAGE and 'Width' in xobj and 'Height' in xobj:
-            self.device.begin_figure(xobjid, (0, 0, 1, 1), MATRIX_IDENTITY)
-            self.device.render_image(xobjid, xobj)
-            self.device.end_figure(xobjid)
+            self.render_image(xobjid, xobj)
         else:
             # unsupported xobject type.
             pass
@@ -991,11 +1082,26 @@ class PDFPageInterpreter(object):
             ctm = (0, 1, -1, 0, y1, -x0)
         else:
             ctm = (1, 0, 0, 1, -x0, -y0)
+        self.rsrcmgr.begin_document(page.doc)
         self.device.begin_page(page, ctm)
         self.render_contents(page.resources, page.contents, ctm=ctm)
         self.device.end_page(page)
         return
 
+    # try_process_page(page)
+    #   Processes a page like process_page(), but a failure is handed
+    #   to the device's abort_page() instead of being raised, so that
+    #   the next page can be processed. Returns False on a failure.
+    def try_process_page(self, page):
+        try:
+            self.process_page(page)
+        except Exception, e:
+            if 1 <= self.debug:
+                traceback.print_exc()
+            self.device.abort_page(page, e)
+            return False
+        return True
+
     # render_contents(resources, streams, ctm)
     #   Render the content streams.
     #   This method may be called recursively.
@@ -1014,79 +1120,69 @@ class PDFPageInterpreter(object):
         except PSEOF:
             # empty page
             return
-        while 1:
-            try:
-                (_, obj) = parser.nextobject()
-            except PSEOF:
-                break
+        operators = self.operators
+        for (_, obj) in parser.iterobjects():
             if isinstance(obj, PSKeyword):
-                name = keyword_name(obj)
-                method = 'do_%s' % name.replace('*', '_a').replace('"', '_w').replace("'", '_q')
-                if hasattr(self, method):
-                    func = getattr(self, method)
-                    nargs = func.func_code.co_argcount-1
-                    if nargs:
-                        if name == 'cs' or name == 'CS':
-                            cs_name = self.pop(nargs)
-                            if name == 'CS':
-                                num_cs_attr = 1
-                                self.scs = self.csmap[literal_name(str(cs_name)[2:-1])]
-                            else:
-                                num_cs_attr = 0
-                                self.ncs = self.csmap[literal_name(str(cs_name)[2:-1])]
-
-                            cs_dict = ((self.__dict__.get('csmap')))
-                            cs_values = cs_dict.get(str(cs_name)[2:-1])
-                            num_of_components = cs_values.ncomponents
-                            if num_of_components == 3:
-                                (_,color_obj) = parser.nextobject()
-                                r = color_obj
-                                (_,color_obj) = parser.nextobject()
-                                g = color_obj
-                                (_,color_obj) = parser.nextobject()
-                                b = color_obj
-                                if num_cs_attr == 1:
-                                    self.do_RG(r,g,b)
-                                else:
-                                    self.do_rg(r,g,b)
-                            elif num_of_components == 4:
-                                (_,color_obj) = parser.nextobject()
-                                c = color_obj
-                                (_,color_obj) = parser.nextobject()
-                                m = color_obj
-                                (_,color_obj) = parser.nextobject()
-                                y = color_obj
-                                (_,color_obj) = parser.nextobject()
-                                k = color_obj
-                                if num_cs_attr == 1:
-                                    self.do_K(c,m,y,k)
-                                else:
-                                    self.do_k(c,m,y,k)
-                            else:
-                                (_,color_obj) = parser.nextobject()
-                                g = color_obj
-                                if num_cs_attr == 1:
-                                    if self.is_number(g):
-                                        self.do_G(g)
-                                else:
-                                    self.do_g(g)
-
-                            args = cs_name
-
-
-                        else:
-                            args = self.pop(nargs)
-                            if 2 <= self.debug:
-                                print >>sys.stderr, 'exec: %s %r' % (name, args)
-                            if len(args) == nargs:
-                                func(*args)
-                    else:
-                        if 2 <= self.debug:
-                            print >>sys.stderr, 'exec: %s' % (name)
-                        func()
-                else:
+                try:
+                    (func, nargs) = operators[obj]
+                except KeyError:
                     if STRICT:
-                        raise PDFInterpreterError('Unknown operator: %r' % name)
+                        raise PDFInterpreterError('Unknown operator: %r' % obj.name)
+                    continue
+                if nargs:
+                    args = self.pop(nargs)
+                    if 2 <= self.debug:
+                        print >>sys.stderr, 'exec: %s %r' % (obj.name, args)
+                    if len(args) == nargs:
+                        func(*args)
+                else:
+                    if 2 <= self.debug:
+                        print >>sys.stderr, 'exec: %s' % obj.name
+                    func()
             else:
                 self.push(obj)
         return
+
+
+##  PDFTextPageInterpreter
+##
+class PDFTextPageInterpreter(PDFPageInterpreter):
+
+    """An interpreter for the text only.
+
+    The paths, their painting and the colors are ignored, so the
+    device gets no lines, rectangles or curves and the text has the
+    default color. The text state and the graphic state matrices are
+    followed as usual, as are the images and forms.
+    """
+
+    ignored_operators = (
+        # path construction and painting
+        'm', 'l', 'c', 'v', 'y', 'h', 're',
+        'S', 's', 'f', 'F', 'f*', 'B', 'B*', 'b', 'b*', 'n', 'W', 'W*', 'sh',
+        # line style
+        'w', 'J', 'j', 'M', 'd', 'ri', 'i',
+        # colors
+        'CS', 'cs', 'SC', 'sc', 'SCN', 'scn', 'G', 'g', 'RG', 'rg', 'K', 'k',
+    )
+
+
+import unittest
+
+
+##  Simplistic Test cases
+##
+class TestPDFTextPageInterpreter(unittest.TestCase):
+
+    def test_1(self):
+        from lc_pdfdevice import PDFDevice
+        rsrcmgr = PDFResourceManager()
+        interpreter = PDFTextPageInterpreter(rsrcmgr, PDFDevice(rsrcmgr))
+        interpreter.init_resources({})
+        interpreter.init_state(MATRIX_IDENTITY)
+        interpreter.execute([PDFStream({}, '0.1 0.2 0.3 sc 1 0 0 SC /P0 scn 0.5 /P1 SCN\n')])
+        self.assertEqual(interpreter.argstack, [])
+        return
+
+if __name__ == '__main__':
+    unittest.main()
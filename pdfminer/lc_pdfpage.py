@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import sys
+from bisect import bisect_right
 from lc_psparser import LIT
 from lc_pdftypes import PDFObjectNotFound
 from lc_pdftypes import resolve1
@@ -116,14 +117,27 @@ class PDFPage(object):
     @classmethod
     def get_pages(klass, fp,
                   pagenos=None, maxpages=0, password='',
-                  caching=True, check_extractable=True):
+                  caching=True, check_extractable=True, skip_image_data=False,
+                  index=None, max_cache_bytes=0):
         # Create a PDF parser object associated with the file object.
-        parser = PDFParser(fp)
+        parser = PDFParser(fp, skip_image_data=skip_image_data)
         # Create a PDF document object that stores the document structure.
-        doc = PDFDocument(parser, password=password, caching=caching)
+        doc = PDFDocument(parser, password=password, caching=caching, index=index,
+                          max_cache_bytes=max_cache_bytes)
         # Check if the document allows text extraction. If not, abort.
         if check_extractable and not doc.is_extractable:
             raise PDFTextExtractionNotAllowed('Text extraction is not allowed: %r' % fp)
+        # Only the selected pages are read from the page tree.
+        if pagenos or maxpages:
+            pageindex = PDFPageIndex(doc)
+            if len(pageindex):
+                for pageno in pageindex.select(pagenos, maxpages):
+                    page = pageindex.get_page(pageno)
+                    if page is None:
+                        break
+                    (objid, tree) = page
+                    yield klass(doc, objid, tree)
+                return
         # Process each page contained in the document.
         for (pageno, page) in enumerate(klass.create_pages(doc)):
             if pagenos and (pageno not in pagenos):
@@ -132,3 +146,256 @@ class PDFPage(object):
             if maxpages and maxpages <= pageno+1:
                 break
         return
+
+
+##  PDFPageIndex
+##
+class PDFPageIndex(object):
+
+    """Finds the pages of a document by their number.
+
+    PDFPage.create_pages() reads the whole page tree in order. Here,
+    the /Count of the kids of a node tells which kid holds a page, so
+    only the nodes on the way to the page and their kids are read.
+    The /Pages nodes that were read are kept, so the following pages
+    are found without reading them again.
+
+    The /Count of a subtree that is skipped is trusted, and a node
+    with as many kids as its /Count is taken to have only pages as
+    kids, which saves reading the kids of a flat tree. When a node
+    that is read does not hold as many pages as it was taken to have,
+    the counts are not trusted any more and the tree is read as a
+    whole, so that the pages are numbered as create_pages() numbers
+    them.
+    """
+
+    def __init__(self, document, debug=0):
+        self.document = document
+        self.debug = debug
+        self.trusted = True
+        # {objid: (tree, kids, ends)} of the /Pages nodes; ends are
+        # the cumulative numbers of pages of the kids.
+        self.nodes = {}
+        self.visiting = set()
+        return
+
+    def __repr__(self):
+        return '<PDFPageIndex: nodes=%d, trusted=%r>' % (len(self.nodes), self.trusted)
+
+    def __len__(self):
+        while 1:
+            trusted = self.trusted
+            n = self.count_root()
+            if trusted == self.trusted:
+                return n
+
+    def get_page(self, pageno):
+        """Returns (objid, attrs) of a page, or None."""
+        while 1:
+            trusted = self.trusted
+            page = self.find(pageno)
+            if trusted == self.trusted:
+                return page
+
+    def select(self, pagenos=None, maxpages=0):
+        """Returns the numbers of the pages that PDFPage.get_pages()
+        yields for pagenos and maxpages."""
+        while 1:
+            trusted = self.trusted
+            n = len(self)
+            selected = []
+            for pageno in sorted(pagenos or xrange(n)):
+                if pageno < 0:
+                    continue
+                if n <= pageno:
+                    break
+                selected.append(pageno)
+                if maxpages and maxpages <= pageno+1:
+                    break
+            # the nodes on the way to the pages check their /Count.
+            for pageno in selected:
+                self.get_page(pageno)
+            if trusted == self.trusted:
+                return selected
+
+    # get_objid(obj)
+    def get_objid(self, obj):
+        if isinstance(obj, int):
+            return obj
+        return obj.objid
+
+    # get_node(objid)
+    #   A missing node is empty, as in create_pages().
+    def get_node(self, objid):
+        try:
+            return dict_value(self.document.getobj(objid))
+        except PDFObjectNotFound:
+            return {}
+
+    # read(objid, parent)
+    #   Returns the attributes of a node, with the ones it inherits.
+    def read(self, objid, parent):
+        tree = self.get_node(objid).copy()
+        for (k, v) in parent.iteritems():
+            if k in PDFPage.INHERITABLE_ATTRS and k not in tree:
+                tree[k] = v
+        return tree
+
+    # visit(objid, parent)
+    #   Returns (tree, kids, ends) of a node: kids is None for a page.
+    def visit(self, objid, parent):
+        if objid in self.nodes:
+            return self.nodes[objid]
+        tree = self.read(objid, parent)
+        if tree.get('Type') is LITERAL_PAGE:
+            return (tree, None, None)
+        if tree.get('Type') is not LITERAL_PAGES or 'Kids' not in tree:
+            return (tree, [], [])
+        if 1 <= self.debug:
+            print >>sys.stderr, 'Pages: Kids=%r' % tree['Kids']
+        trusted = self.trusted
+        kids = [self.get_objid(kid) for kid in list_value(tree['Kids'])]
+        count = self.get_count(tree)
+        if trusted and count == len(kids):
+            # as many pages as kids: every kid is taken as a page.
+            ends = range(1, len(kids)+1)
+        else:
+            ends = []
+            n = 0
+            self.visiting.add(objid)
+            try:
+                for kid in kids:
+                    n += self.count(kid, tree)
+                    ends.append(n)
+            finally:
+                self.visiting.discard(objid)
+            if self.trusted and count != n:
+                self.mistrust(tree, n)
+        # the nodes that were counted with the /Count are dropped.
+        if trusted == self.trusted:
+            self.nodes[objid] = (tree, kids, ends)
+        return (tree, kids, ends)
+
+    # mistrust(tree, n)
+    #   The node has n pages, not as many as it was taken to have.
+    def mistrust(self, tree, n):
+        if 1 <= self.debug:
+            print >>sys.stderr, 'Pages: Count=%r, pages=%d' % (tree.get('Count'), n)
+        self.trusted = False
+        self.nodes.clear()
+        return
+
+    # get_count(tree)
+    #   Returns the /Count of a node, or None if it is not valid.
+    def get_count(self, tree):
+        count = resolve1(tree.get('Count'))
+        if not isinstance(count, int) or count < 0:
+            return None
+        return count
+
+    # count(objid, parent)
+    #   Returns the number of pages under a node.
+    def count(self, objid, parent):
+        if objid in self.visiting:
+            return 0
+        if objid in self.nodes:
+            return (self.nodes[objid][2] or [0])[-1]
+        obj = self.get_node(objid)
+        if obj.get('Type') is LITERAL_PAGE:
+            return 1
+        if obj.get('Type') is not LITERAL_PAGES or 'Kids' not in obj:
+            return 0
+        if self.trusted:
+            count = self.get_count(obj)
+            if count is not None:
+                return count
+        (_, _, ends) = self.visit(objid, parent)
+        return (ends or [0])[-1]
+
+    # count_root()
+    #   The root is always read, so that its /Count is checked.
+    def count_root(self):
+        catalog = self.document.catalog
+        if 'Pages' not in catalog:
+            return 0
+        (_, kids, ends) = self.visit(self.get_objid(catalog['Pages']), catalog)
+        if kids is None:
+            return 1
+        return (ends or [0])[-1]
+
+    # find(pageno)
+    #   Every node on the way must have as many pages as its
+    #   parent took it to have.
+    def find(self, pageno):
+        catalog = self.document.catalog
+        if 'Pages' not in catalog:
+            return None
+        (objid, parent) = (self.get_objid(catalog['Pages']), catalog)
+        expected = None
+        while 1:
+            (tree, kids, ends) = self.visit(objid, parent)
+            if kids is None:
+                n = 1
+            else:
+                n = (ends or [0])[-1]
+            if self.trusted and expected is not None and n != expected:
+                self.mistrust(tree, n)
+                return None
+            if kids is None:
+                if pageno != 0:
+                    return None
+                if 1 <= self.debug:
+                    print >>sys.stderr, 'Page: %r' % tree
+                return (objid, tree)
+            i = bisect_right(ends, pageno)
+            if i == len(kids):
+                return None
+            expected = ends[i]
+            if i:
+                pageno -= ends[i-1]
+                expected -= ends[i-1]
+            (objid, parent) = (kids[i], tree)
+        return None
+
+
+import unittest
+
+
+##  Simplistic Test cases
+##
+class TestPDFPageIndex(unittest.TestCase):
+
+    # object 9 is missing from the page tree.
+    OBJS = [
+        (1, '<< /Type /Catalog /Pages 2 0 R >>'),
+        (2, '<< /Type /Pages /Kids [3 0 R 9 0 R 4 0 R] /Count 3 /MediaBox [0 0 612 792] /Resources << >> >>'),
+        (3, '<< /Type /Page /Parent 2 0 R >>'),
+        (4, '<< /Type /Page /Parent 2 0 R /Rotate 90 >>'),
+    ]
+
+    def make_pdf(self):
+        data = '%PDF-1.4\n'
+        offsets = []
+        for (objid, obj) in self.OBJS:
+            offsets.append(len(data))
+            data += '%d 0 obj\n%s\nendobj\n' % (objid, obj)
+        xref = len(data)
+        data += 'xref\n0 %d\n0000000000 65535 f \n' % (len(self.OBJS)+1)
+        for pos in offsets:
+            data += '%010d 00000 n \n' % pos
+        data += 'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(self.OBJS)+1, xref)
+        return data
+
+    def test_1(self):
+        from StringIO import StringIO
+        data = self.make_pdf()
+        pages = [page.pageid for page in PDFPage.get_pages(StringIO(data))]
+        self.assertEqual(pages, [3, 4])
+        pages = [page.pageid for page in PDFPage.get_pages(StringIO(data), maxpages=2)]
+        self.assertEqual(pages, [3, 4])
+        pages = [page.pageid for page in PDFPage.get_pages(StringIO(data), set([1]))]
+        self.assertEqual(pages, [4])
+        return
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,12 +6,14 @@ except ImportError:
     from StringIO import StringIO
 from lc_psparser import PSStackParser
 from lc_psparser import PSSyntaxError, PSEOF
-from lc_psparser import KWD, STRICT
+from lc_psparser import KWD, LIT, STRICT
 from lc_pdftypes import PDFException
 from lc_pdftypes import PDFStream, PDFObjRef
 from lc_pdftypes import int_value
 from lc_pdftypes import dict_value
 
+LITERAL_IMAGE = LIT('Image')
+
 
 ##  Exceptions
 ##
@@ -39,10 +41,12 @@ class PDFParser(PSStackParser):
 
     """
 
-    def __init__(self, fp):
+    def __init__(self, fp, skip_image_data=False):
         PSStackParser.__init__(self, fp)
         self.doc = None
         self.fallback = False
+        # the data of image streams are not read.
+        self.skip_image_data = skip_image_data
         return
 
     def set_document(self, doc):
@@ -99,8 +103,17 @@ class PDFParser(PSStackParser):
                     raise PDFSyntaxError('Unexpected EOF')
                 return
             pos += len(line)
-            self.fp.seek(pos)
-            data = self.fp.read(objlen)
+            # the data of an image are passed over without keeping them.
+            skip = self.skip_image_data and dic.get('Subtype') is LITERAL_IMAGE
+            if skip and self.fallback:
+                objlen = self.check_length(pos, dic.get('Length'))
+            if skip:
+                data = ''
+            elif self.mapped:
+                data = self.buf[pos:pos+objlen]
+            else:
+                self.fp.seek(pos)
+                data = self.fp.read(objlen)
             self.seek(pos+objlen)
             while 1:
                 try:
@@ -112,15 +125,19 @@ class PDFParser(PSStackParser):
                 if 'endstream' in line:
                     i = line.index('endstream')
                     objlen += i
-                    data += line[:i]
+                    if not skip:
+                        data += line[:i]
                     break
                 objlen += len(line)
-                data += line
+                if not skip:
+                    data += line
             self.seek(pos+objlen)
             # XXX limit objlen not to exceed object boundary
             if 2 <= self.debug:
                 print >>sys.stderr, 'Stream: pos=%d, objlen=%d, dic=%r, data=%r...' % \
                                     (pos, objlen, dic, data[:10])
+            if skip:
+                data = None
             obj = PDFStream(dic, data, self.doc.decipher)
             self.push((pos, obj))
 
@@ -130,6 +147,22 @@ class PDFParser(PSStackParser):
 
         return
 
+    # check_length(pos, length)
+    #   Returns the /Length of a stream that starts at pos if the
+    #   endstream keyword follows it, otherwise 0: the data are then
+    #   scanned for endstream.
+    def check_length(self, pos, length):
+        if not isinstance(length, int) or length <= 0:
+            return 0
+        if self.mapped:
+            tail = self.buf[pos+length:pos+length+12]
+        else:
+            self.fp.seek(pos+length)
+            tail = self.fp.read(12)
+        if not tail.lstrip('\r\n').startswith('endstream'):
+            return 0
+        return length
+
 
 ##  PDFStreamParser
 ##
@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+"""
+A long-running conversion server.
+
+The server imports the whole engine once and forks a pool of worker
+processes from it, so a request does not pay for the imports of the
+glyph list, encodings and font metrics, nor for loading the CMaps
+given with -w. The workers are kept between requests and with them
+their CMapDB caches. A PDFResourceManager is
+still made for every document, as its font cache is keyed by object
+ids, which are only meaningful within a document.
+
+A request is an HTTP POST to /convert, either with the PDF file as
+its body or with the path of a local file:
+
+  curl --data-binary @doc.pdf 'http://localhost:8765/convert?type=xml'
+  curl -X POST 'http://localhost:8765/convert?path=/data/doc.pdf&brief=1'
+
+The query can also set pages, maxpages, password, rotation, codec,
+char_margin, line_margin, word_margin, boxes_flow, layout=0,
+text_only=1 (see PDFTextPageInterpreter), images=bbox|none (the
+image data are not read) and ocr_words=1 (see LAParams.ocr_words).
+GET /status returns the state of the server as JSON.
+
+SIGHUP replaces the worker pool with a fresh one; the requests in
+progress are completed by the old pool. SIGTERM stops accepting
+requests and exits when the requests in progress are done.
+"""
+import sys
+import os
+import os.path
+import json
+import signal
+import socket
+import threading
+import traceback
+import urlparse
+import SocketServer
+import BaseHTTPServer
+from cStringIO import StringIO
+from multiprocessing import Pool
+from pdfminer.lc_pdfdocument import PDFDocument
+from pdfminer.lc_pdfparser import PDFParser
+from pdfminer.lc_pdfinterp import PDFResourceManager, PDFPageInterpreter
+from pdfminer.lc_pdfinterp import PDFTextPageInterpreter
+from pdfminer.lc_pdfdevice import PDFDevice
+from pdfminer.lc_pdfpage import PDFPage
+from pdfminer.lc_converter import XMLConverter, HTMLConverter, TextConverter, LegalXMLConverter
+from pdfminer.lc_cmapdb import CMapDB
+from pdfminer.lc_layout import LAParams
+from pdfminer.lc_prefork import warm_up
+from pdfminer.lc_utils import map_file
+from pdfminer.lc_xrefindex import XRefIndex, get_index
+
+# the float options of LAParams that a request may set.
+LAPARAMS_OPTIONS = ('char_margin', 'line_margin', 'word_margin', 'boxes_flow')
+
+
+##  ConversionError
+##
+class ConversionError(Exception):
+    pass
+
+
+# parse_options
+def parse_options(query, mapped=False, xrefcache=None, max_cache_bytes=0):
+    """Turns the query of a request into the options of convert()."""
+    args = dict((k, v[-1]) for (k, v) in urlparse.parse_qs(query).iteritems())
+    options = {
+        'path': args.get('path'),
+        'outtype': args.get('type', 'xml'),
+        'make_brief': args.get('brief', '0') not in ('', '0'),
+        'text_only': args.get('text_only', '0') not in ('', '0'),
+        'imagemode': args.get('images', 'all'),
+        'pagenos': set(),
+        'maxpages': int(args.get('maxpages', 0)),
+        'password': args.get('password', ''),
+        'rotation': int(args.get('rotation', 0)),
+        'codec': args.get('codec', 'utf-8'),
+        'laparams': None,
+        'mapped': mapped,
+        'xrefcache': xrefcache,
+        'max_cache_bytes': max_cache_bytes,
+        }
+    if options['outtype'] not in ('text', 'html', 'xml'):
+        raise ValueError('unknown type: %r' % options['outtype'])
+    if options['imagemode'] not in ('all', 'bbox', 'none'):
+        raise ValueError('unknown images: %r' % options['imagemode'])
+    if 'pages' in args:
+        options['pagenos'].update(int(x)-1 for x in args['pages'].split(','))
+    if args.get('layout', '1') not in ('', '0'):
+        laparams = LAParams()
+        for k in LAPARAMS_OPTIONS:
+            if k in args:
+                setattr(laparams, k, float(args[k]))
+        laparams.ocr_words = args.get('ocr_words', '0') not in ('', '0')
+        options['laparams'] = laparams
+    return options
+
+
+# convert
+def convert(options, data=None):
+    """Converts a PDF and returns the output as a string together
+    with the (pageid, message) of the pages that failed.
+
+    The PDF is read from options['path'] or, if data is given, from
+    data. Runs in a worker process.
+    """
+    index = None
+    if data is not None:
+        fp = StringIO(data)
+    else:
+        index = get_index(options['path'], options['xrefcache'])
+        fp = file(options['path'], 'rb')
+        if options['mapped']:
+            fp = map_file(fp)
+    outfp = StringIO()
+    try:
+        rsrcmgr = PDFResourceManager()
+        laparams = options['laparams']
+        codec = options['codec']
+        if options['outtype'] == 'text':
+            device = TextConverter(rsrcmgr, outfp, codec=codec, laparams=laparams)
+        elif options['outtype'] == 'html':
+            device = HTMLConverter(rsrcmgr, outfp, codec=codec, laparams=laparams)
+        elif options['make_brief']:
+            device = LegalXMLConverter(rsrcmgr, outfp, codec=codec, laparams=laparams)
+        else:
+            device = XMLConverter(rsrcmgr, outfp, codec=codec, laparams=laparams)
+        imagemode = options['imagemode']
+        if options['text_only']:
+            interpreter = PDFTextPageInterpreter(rsrcmgr, device, imagemode=imagemode)
+        else:
+            interpreter = PDFPageInterpreter(rsrcmgr, device, imagemode=imagemode)
+        for page in PDFPage.get_pages(fp, options['pagenos'],
+                                      maxpages=options['maxpages'],
+                                      password=options['password'],
+                                      check_extractable=True,
+                                      skip_image_data=(imagemode != 'all'),
+                                      index=index,
+                                      max_cache_bytes=options['max_cache_bytes']):
+            page.rotate = (page.rotate+options['rotation']) % 360
+            interpreter.try_process_page(page)
+        device.close()
+    finally:
+        fp.close()
+    return (outfp.getvalue(), device.page_errors)
+
+
+def _convert_job(args):
+    # exceptions are returned as text, so that the traceback
+    # from the worker process is not lost.
+    try:
+        (output, page_errors) = convert(*args)
+        return (output, page_errors, None)
+    except Exception:
+        return (None, [], traceback.format_exc())
+
+
+def _init_worker():
+    # the signals are meant for the server, not its workers.
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    return
+
+
+##  ConversionService
+##
+class ConversionService(object):
+
+    """Hands out the requests to a pool of worker processes.
+
+    At most processes+backlog requests are accepted at a time, the
+    others are refused. With maxtasks, a worker is replaced after
+    that many requests.
+    """
+
+    debug = 0
+
+    def __init__(self, processes=1, backlog=0, maxtasks=None, mapped=False,
+                 xrefcache=None, max_cache_bytes=0):
+        self.processes = processes
+        self.backlog = backlog
+        self.maxtasks = maxtasks
+        self.mapped = mapped
+        self.xrefcache = xrefcache
+        self.max_cache_bytes = max_cache_bytes
+        self.generation = 0
+        self.served = 0
+        self.failed = 0
+        self.inflight = 0
+        self._lock = threading.Condition()
+        self._pool = self._make_pool()
+        return
+
+    def __repr__(self):
+        return ('<ConversionService: processes=%d, generation=%d, inflight=%d>' %
+                (self.processes, self.generation, self.inflight))
+
+    def _make_pool(self):
+        self.generation += 1
+        return Pool(self.processes, initializer=_init_worker,
+                    maxtasksperchild=self.maxtasks)
+
+    def get_status(self):
+        with self._lock:
+            return {'processes': self.processes, 'backlog': self.backlog,
+                    'generation': self.generation, 'inflight': self.inflight,
+                    'served': self.served, 'failed': self.failed}
+
+    def convert(self, options, data=None):
+        """Converts a PDF with a worker. Returns the output and the
+        page errors, or None if the service is busy. Raises
+        ConversionError on failure."""
+        with self._lock:
+            if self.processes+self.backlog <= self.inflight:
+                return None
+            self.inflight += 1
+            pool = self._pool
+        (output, page_errors, error) = (None, [], 'interrupted')
+        try:
+            (output, page_errors, error) = pool.apply_async(_convert_job, [(options, data)]).get()
+        finally:
+            with self._lock:
+                self.inflight -= 1
+                if error is None:
+                    self.served += 1
+                else:
+                    self.failed += 1
+                self._lock.notify_all()
+        if error is not None:
+            raise ConversionError(error)
+        return (output, page_errors)
+
+    def reload(self):
+        """Replaces the pool of workers. The old pool completes
+        the requests it already has."""
+        with self._lock:
+            (old, self._pool) = (self._pool, self._make_pool())
+        old.close()
+        thread = threading.Thread(target=old.join)
+        thread.daemon = True
+        thread.start()
+        if 1 <= self.debug:
+            print >>sys.stderr, 'reload: generation %d' % self.generation
+        return
+
+    def close(self):
+        """Waits for the requests in progress and stops the workers."""
+        with self._lock:
+            while self.inflight:
+                self._lock.wait(1)
+        self._pool.close()
+        self._pool.join()
+        return
+
+
+##  ConversionRequestHandler
+##
+class ConversionRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        if 1 <= self.server.service.debug:
+            # a Unix socket has no client address.
+            if isinstance(self.client_address, tuple):
+                client = self.client_address[0]
+            else:
+                client = 'unix'
+            print >>sys.stderr, '%s - [%s] %s' % \
+                  (client, self.log_date_time_string(), format % args)
+        return
+
+    def send_body(self, code, body, ctype='text/plain', page_errors=None):
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        if page_errors is not None:
+            # the failed pages are in the output as pages with an error.
+            self.send_header('X-Page-Errors', str(page_errors))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def do_GET(self):
+        if urlparse.urlsplit(self.path).path != '/status':
+            self.send_body(404, 'not found\n')
+            return
+        self.send_body(200, json.dumps(self.server.service.get_status()),
+                       'application/json')
+        return
+
+    def do_POST(self):
+        url = urlparse.urlsplit(self.path)
+        if url.path != '/convert':
+            self.send_body(404, 'not found\n')
+            return
+        data = None
+        length = int(self.headers.getheader('Content-Length') or 0)
+        if length:
+            data = self.rfile.read(length)
+        try:
+            service = self.server.service
+            options = parse_options(url.query, mapped=service.mapped,
+                                    xrefcache=service.xrefcache,
+                                    max_cache_bytes=service.max_cache_bytes)
+        except ValueError, e:
+            self.send_body(400, '%s\n' % e)
+            return
+        if data is None and not options['path']:
+            self.send_body(400, 'no PDF: give a path or a request body\n')
+            return
+        try:
+            result = self.server.service.convert(options, data)
+        except ConversionError, e:
+            self.send_body(422, str(e))
+            return
+        if result is None:
+            self.send_body(503, 'busy\n')
+            return
+        (output, page_errors) = result
+        if options['outtype'] == 'xml':
+            ctype = 'application/xml; charset=%s' % options['codec']
+        elif options['outtype'] == 'html':
+            ctype = 'text/html; charset=%s' % options['codec']
+        else:
+            ctype = 'text/plain; charset=%s' % options['codec']
+        self.send_body(200, output, ctype, page_errors=len(page_errors))
+        return
+
+
+##  ConversionServer
+##
+class ConversionServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        self.service = service
+        BaseHTTPServer.HTTPServer.__init__(self, address, ConversionRequestHandler)
+        return
+
+
+##  UnixConversionServer
+##
+class UnixConversionServer(ConversionServer):
+
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        SocketServer.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+        return
+
+
+# main
+def main(argv):
+    import getopt
+    def usage():
+        print ('usage: %s [-d] [-p port] [-s socket] [-j processes] [-b backlog]'
+               ' [-r requests] [-w cmap,...] [-z] [-X index folder]'
+               ' [-K cache megabytes]' % argv[0])
+        return 100
+    try:
+        (opts, args) = getopt.getopt(argv[1:], 'dp:s:j:b:r:w:zX:K:')
+    except getopt.GetoptError:
+        return usage()
+    if args: return usage()
+    debug = 0
+    port = 8765
+    sockpath = None
+    processes = 2
+    backlog = None
+    maxtasks = None
+    cmapnames = []
+    mapped = False
+    xrefcache = None
+    max_cache_bytes = 0
+    for (k, v) in opts:
+        if k == '-d': debug += 1
+        elif k == '-p': port = int(v)
+        elif k == '-s': sockpath = v
+        elif k == '-j': processes = int(v)
+        elif k == '-b': backlog = int(v)
+        elif k == '-r': maxtasks = int(v)
+        elif k == '-w': cmapnames.extend(v.split(','))
+        elif k == '-z': mapped = True
+        elif k == '-X': xrefcache = v
+        elif k == '-K': max_cache_bytes = int(v)*1024*1024
+    if processes < 1:
+        return usage()
+    if backlog is None:
+        backlog = processes
+    #
+    PDFDocument.debug = debug
+    PDFParser.debug = debug
+    CMapDB.debug = debug
+    PDFResourceManager.debug = debug
+    PDFPageInterpreter.debug = debug
+    PDFDevice.debug = debug
+    ConversionService.debug = debug
+    XRefIndex.debug = debug
+    # the workers are forked with the CMaps already loaded.
+    for name in warm_up(cmapnames, debug=debug):
+        print >>sys.stderr, 'warning: CMap not found: %s' % name
+    #
+    service = ConversionService(processes=processes, backlog=backlog, maxtasks=maxtasks,
+                                mapped=mapped, xrefcache=xrefcache,
+                                max_cache_bytes=max_cache_bytes)
+    if sockpath:
+        server = UnixConversionServer(sockpath, service)
+    else:
+        server = ConversionServer(('127.0.0.1', port), service)
+    def reload(signum, frame):
+        service.reload()
+        return
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever(), so it needs another thread.
+        threading.Thread(target=server.shutdown).start()
+        return
+    signal.signal(signal.SIGHUP, reload)
+    signal.signal(signal.SIGTERM, stop)
+    print >>sys.stderr, 'serving on %s' % (sockpath or 'http://127.0.0.1:%d/' % port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    service.close()
+    if sockpath and os.path.exists(sockpath):
+        os.remove(sockpath)
+    return
+
+if __name__ == '__main__': sys.exit(main(sys.argv))
@@ -189,8 +189,10 @@ class PDFStream(PDFObject):
         return
 
     def __repr__(self):
-        if self.data is None:
-            assert self.rawdata is not None
+        if self.data is None and self.rawdata is None:
+            # the data were not read (see PDFParser.skip_image_data).
+            return '<PDFStream(%r): unread, %r>' % (self.objid, self.attrs)
+        elif self.data is None:
             return '<PDFStream(%r): raw=%d, %r>' % (self.objid, len(self.rawdata), self.attrs)
         else:
             assert self.data is not None
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+Warm-up of a process that forks workers.
+
+The batch and server modes fork their workers from the main process.
+Everything that is loaded before the fork is shared copy-on-write by
+the workers instead of being loaded by each of them: the module level
+tables (glyph names, encodings, font metrics) come with the imports,
+warm_up() adds the CMaps that the documents are expected to use.
+"""
+import sys
+import gc
+from lc_cmapdb import CMapDB
+# imported for their tables.
+import lc_glyphlist
+import lc_latin_enc
+import lc_encodingdb
+import lc_fontmetrics
+import lc_pdffont
+
+
+# warm_up
+def warm_up(cmapnames=(), debug=0):
+    """Loads the named CMaps into the CMapDB caches.
+
+    A name is either the name of a CMap (e.g. 'UniJIS-UCS2-H') or
+    a character collection (e.g. 'Adobe-Japan1'), whose Unicode maps
+    are loaded. Returns the names that could not be found.
+    """
+    missing = []
+    for name in cmapnames:
+        try:
+            CMapDB.get_cmap(name)
+            continue
+        except CMapDB.CMapNotFound:
+            pass
+        try:
+            CMapDB.get_unicode_map(name)
+        except CMapDB.CMapNotFound:
+            missing.append(name)
+    # collect the garbage of the imports now, rather than once
+    # in every worker after it has touched (and copied) the pages.
+    gc.collect()
+    if 1 <= debug:
+        print >>sys.stderr, 'warm_up: cmaps=%r, umaps=%r, missing=%r' % \
+              (sorted(CMapDB._cmap_cache), sorted(CMapDB._umap_cache), missing)
+    return missing
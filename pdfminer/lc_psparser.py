@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 import sys
 import re
+import mmap
+from collections import deque
 from lc_utils import choplist
 
 STRICT = 0
@@ -62,6 +64,10 @@ class PSLiteral(PSObject):
     def __repr__(self):
         return '/%s' % self.name
 
+    def __reduce__(self):
+        # unpickled literals must stay interned.
+        return (intern_literal, (self.name,))
+
 
 ##  PSKeyword
 ##
@@ -84,6 +90,10 @@ class PSKeyword(PSObject):
     def __repr__(self):
         return self.name
 
+    def __reduce__(self):
+        # unpickled keywords must stay interned.
+        return (intern_keyword, (self.name,))
+
 
 ##  PSSymbolTable
 ##
@@ -119,6 +129,14 @@ KEYWORD_DICT_BEGIN = KWD('<<')
 KEYWORD_DICT_END = KWD('>>')
 
 
+def intern_literal(name):
+    return PSLiteralTable.intern(name)
+
+
+def intern_keyword(name):
+    return PSKeywordTable.intern(name)
+
+
 def literal_name(x):
     if not isinstance(x, PSLiteral):
         if STRICT:
@@ -151,18 +169,44 @@ END_KEYWORD = re.compile(r'[#/%\[\]()<>{}\s]')
 END_STRING = re.compile(r'[()\134]')
 OCT_STRING = re.compile(r'[0-7]')
 ESC_STRING = {'b': 8, 't': 9, 'n': 10, 'f': 12, 'r': 13, '(': 40, ')': 41, '\\': 92}
+ESC_SEQUENCE = re.compile(r'\\([0-7]{1,3}|.)', re.S)
+# One token of any kind that _parse_bulk() can handle by itself.
+# Names and keywords must be followed by their delimiter; a string
+# must be closed and have no nested parentheses.
+BULK_TOKEN = re.compile(
+    r'\s*(?:'
+    r'(?P<number>[-+0-9][0-9]*(?:\.[0-9]*)?|\.[0-9]*)|'
+    r'(?P<keyword>[A-Za-z][^#/%\[\]()<>{}\s]*)(?=[#/%\[\]()<>{}\s])|'
+    r'(?P<literal>/[^#/%\[\]()<>{}\s]*)(?=[/%\[\]()<>{}\s])|'
+    r'(?P<string>\([^()\\]*(?:\\.[^()\\]*)*\))|'
+    r'(?P<dictbegin><<)|'
+    r'(?P<hexstring><[\s0-9a-fA-F]*)(?=[^\s0-9a-fA-F])|'
+    r'(?P<dictend>>>)|'
+    r'(?P<wclose>>)(?=.)|'
+    r'(?P<comment>%[^\r\n]*)(?=[\r\n])|'
+    r'(?P<char>[^-+.0-9A-Za-z/()<>%\s])'
+    r')', re.S)
 
 
 class PSBaseParser(object):
 
     """Most basic PostScript parser that performs only tokenization.
+
+    fp may also be a memory map of the file (see map_file()), which
+    is then tokenized directly, without reading it into a buffer.
     """
     BUFSIZ = 4096
 
     debug = 0
 
+    # if true, nexttoken() tokenizes the buffer in bulk (see _parse_bulk).
+    bulk = False
+    # the keywords after which the bulk tokenizer stops.
+    bulk_stop = ()
+
     def __init__(self, fp):
         self.fp = fp
+        self.mapped = isinstance(fp, mmap.mmap)
         self.seek(0)
         return
 
@@ -193,21 +237,29 @@ class PSBaseParser(object):
         """
         if 2 <= self.debug:
             print >>sys.stderr, 'seek: %r' % pos
-        self.fp.seek(pos)
         # reset the status for nextline()
-        self.bufpos = pos
-        self.buf = ''
-        self.charpos = 0
+        if self.mapped:
+            # the whole file is the buffer.
+            self.bufpos = 0
+            self.buf = self.fp
+            self.charpos = pos
+        else:
+            self.fp.seek(pos)
+            self.bufpos = pos
+            self.buf = ''
+            self.charpos = 0
         # reset the status for nexttoken()
         self._parse1 = self._parse_main
         self._curtoken = ''
         self._curtokenpos = 0
-        self._tokens = []
+        self._tokens = deque()
         return
 
     def fillbuf(self):
         if self.charpos < len(self.buf):
             return
+        if self.mapped:
+            raise PSEOF('Unexpected EOF')
         # fetch next chunk.
         self.bufpos = self.fp.tell()
         self.buf = self.fp.read(self.BUFSIZ)
@@ -477,16 +529,97 @@ class PSBaseParser(object):
         self._parse1 = self._parse_main
         return j
 
+    def _parse_bulk(self, s, i):
+        """Tokenizes s from i with a single regular expression.
+
+        It stops at the end of s, after a keyword of bulk_stop, or
+        before a token that is left to the state machine: a token
+        that may go on in the next buffer, a string with nested
+        parentheses, a name with # escapes. The tokens are the same
+        as the state machine would produce.
+        """
+        n = len(s)
+        bufpos = self.bufpos
+        tokens = self._tokens
+        match = BULK_TOKEN.match
+        while 1:
+            m = match(s, i)
+            if not m:
+                break
+            kind = m.lastgroup
+            j = m.end(0)
+            if kind == 'number':
+                if j == n:
+                    break
+                x = m.group(kind)
+                try:
+                    if '.' in x:
+                        tokens.append((bufpos+m.start(kind), float(x)))
+                    else:
+                        tokens.append((bufpos+m.start(kind), int(x)))
+                except ValueError:
+                    pass
+            elif kind == 'keyword':
+                x = m.group(kind)
+                if x == 'true':
+                    token = True
+                elif x == 'false':
+                    token = False
+                else:
+                    token = KWD(x)
+                tokens.append((bufpos+m.start(kind), token))
+                if token in self.bulk_stop:
+                    i = j
+                    break
+            elif kind == 'literal':
+                tokens.append((bufpos+m.start(kind), LIT(m.group(kind)[1:])))
+            elif kind == 'string':
+                x = m.group(kind)[1:-1]
+                if '\\' in x:
+                    try:
+                        x = ESC_SEQUENCE.sub(_unescape, x)
+                    except ValueError:
+                        break
+                tokens.append((bufpos+m.start(kind), x))
+            elif kind == 'char':
+                tokens.append((bufpos+m.start(kind), KWD(m.group(kind))))
+            elif kind == 'hexstring':
+                x = HEX_PAIR.sub(lambda m: chr(int(m.group(0), 16)),
+                                 SPC.sub('', m.group(kind)[1:]))
+                tokens.append((bufpos+m.start(kind), x))
+            elif kind == 'dictbegin':
+                tokens.append((bufpos+m.start(kind), KEYWORD_DICT_BEGIN))
+            elif kind == 'dictend':
+                tokens.append((bufpos+m.start(kind), KEYWORD_DICT_END))
+            # a comment or a lone '>' makes no token.
+            i = j
+        return i
+
     def nexttoken(self):
         while not self._tokens:
             self.fillbuf()
+            if self.bulk and self._parse1 == self._parse_main:
+                self.charpos = self._parse_bulk(self.buf, self.charpos)
+                if self._tokens:
+                    break
             self.charpos = self._parse1(self.buf, self.charpos)
-        token = self._tokens.pop(0)
+        token = self._tokens.popleft()
         if 2 <= self.debug:
             print >>sys.stderr, 'nexttoken: %r' % (token,)
         return token
 
 
+# _unescape
+def _unescape(m):
+    c = m.group(1)
+    if OCT_STRING.match(c):
+        return chr(int(c, 8))
+    if c in ESC_STRING:
+        return chr(ESC_STRING[c])
+    # an unknown escape is dropped.
+    return ''
+
+
 ##  PSStackParser
 ##
 class PSStackParser(PSBaseParser):
@@ -500,7 +633,7 @@ class PSStackParser(PSBaseParser):
         self.context = []
         self.curtype = None
         self.curstack = []
-        self.results = []
+        self.results = deque()
         return
 
     def seek(self, pos):
@@ -553,6 +686,35 @@ class PSStackParser(PSBaseParser):
         Returns keywords, literals, strings, numbers, arrays and dictionaries.
         Arrays and dictionaries are represented as Python lists and dictionaries.
         """
+        if not self.results:
+            self.fillresults()
+        obj = self.results.popleft()
+        if 2 <= self.debug:
+            print >>sys.stderr, 'nextobject: %r' % (obj,)
+        return obj
+
+    def iterobjects(self):
+        """Yields the objects until the end of the input.
+
+        This is the same as calling nextobject() until it raises PSEOF,
+        without a call per object. nextobject() may still be called
+        in between to take the next objects.
+        """
+        while 1:
+            # seek() replaces the results: don't keep a reference.
+            while self.results:
+                obj = self.results.popleft()
+                if 2 <= self.debug:
+                    print >>sys.stderr, 'iterobjects: %r' % (obj,)
+                yield obj
+            try:
+                self.fillresults()
+            except PSEOF:
+                break
+        return
+
+    def fillresults(self):
+        """Parses tokens until there are results."""
         while not self.results:
             (pos, token) = self.nexttoken()
             #print (pos,token), (self.curtype, self.curstack)
@@ -603,10 +765,7 @@ class PSStackParser(PSBaseParser):
                 continue
             else:
                 self.flush()
-        obj = self.results.pop(0)
-        if 2 <= self.debug:
-            print >>sys.stderr, 'nextobject: %r' % (obj,)
-        return obj
+        return
 
 
 import unittest
@@ -702,6 +861,41 @@ func/a/b{(c)do*}def
         objs = self.get_objects(self.TESTDATA)
         print objs
         self.assertEqual(objs, self.OBJS)
+        import StringIO
+
+        class MyParser(PSStackParser):
+            def flush(self):
+                self.add_results(*self.popall())
+        parser = MyParser(StringIO.StringIO(self.TESTDATA))
+        self.assertEqual(list(parser.iterobjects()), self.OBJS)
+        return
+
+    def test_3(self):
+        import cPickle
+        objs = [LIT('a'), KWD('begin')]
+        for (x, y) in zip(cPickle.loads(cPickle.dumps(objs, 2)), objs):
+            self.assertTrue(x is y)
+        return
+
+    def test_4(self):
+        import StringIO
+
+        class MyParser(PSStackParser):
+            bulk = True
+
+            def flush(self):
+                self.add_results(*self.popall())
+        # a small buffer makes tokens span the buffer boundaries.
+        for bufsiz in (4096, 7):
+            parser = MyParser(StringIO.StringIO(self.TESTDATA))
+            parser.BUFSIZ = bufsiz
+            tokens = []
+            try:
+                while 1:
+                    tokens.append(parser.nexttoken())
+            except PSEOF:
+                pass
+            self.assertEqual(tokens, self.TOKENS)
         return
 
 if __name__ == '__main__':
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Size-aware scheduling of batch jobs.
+
+The cost of a job is estimated from the file size or, with the 'pages'
+method, as its number of pages, taken from the /Count of the
+document's page tree. The files are opened in the parent process,
+before any worker runs and without its limits, so a damaged file is
+not searched for its objects; its size is taken instead. The jobs are
+dispatched largest first: the workers of a pool take the next job when
+they are done with the previous one, so the small files fill the gaps
+around the large ones (the "longest processing time first" rule).
+"""
+import sys
+import os
+import heapq
+from lc_pdfparser import PDFParser
+from lc_pdfdocument import PDFDocument
+from lc_pdftypes import resolve1, dict_value, int_value
+
+# the size of an average page, for files whose pages cannot be counted.
+BYTES_PER_PAGE = 100000
+
+
+##  PDFCountingDocument
+##
+class PDFCountingDocument(PDFDocument):
+
+    """A PDFDocument that only reads valid xrefs: PDFNoValidXRef
+    is raised for a damaged file instead of scanning it."""
+
+    def read_xrefs(self, parser, fallback):
+        pos = self.find_xref(parser)
+        self.read_xref_from(parser, pos, self.xrefs)
+        return
+
+
+# count_pages
+def count_pages(path, password=''):
+    """Returns the /Count of the page tree of a PDF file."""
+    fp = file(path, 'rb')
+    try:
+        parser = PDFParser(fp)
+        doc = PDFCountingDocument(parser, password=password)
+        pages = dict_value(doc.catalog['Pages'])
+        return int_value(resolve1(pages['Count']))
+    finally:
+        fp.close()
+
+
+# estimate_cost
+def estimate_cost(job, method='size'):
+    """Returns the estimated cost of a job, in pages."""
+    if method == 'pages':
+        try:
+            return max(1, count_pages(job.pdf_path, password=job.password))
+        except Exception:
+            pass
+    return max(1, os.path.getsize(job.pdf_path) // BYTES_PER_PAGE)
+
+
+##  BatchSchedule
+##
+class BatchSchedule(object):
+
+    """The jobs of a batch in the order they are dispatched.
+
+    plan is what a pool of workers is expected to do with them:
+    a list of (finish, cost, job) for each worker.
+    """
+
+    def __init__(self, jobs, processes=1, method='size'):
+        costs = [(estimate_cost(job, method), i, job) for (i, job) in enumerate(jobs)]
+        # largest first; equal costs keep their original order.
+        costs.sort(key=lambda (cost, i, job): (-cost, i))
+        self.jobs = [job for (_, _, job) in costs]
+        self.costs = dict((job.name, cost) for (cost, _, job) in costs)
+        self.plan = [[] for _ in xrange(max(1, processes))]
+        # each job goes to the worker that becomes idle first.
+        idle = [(0, w) for w in xrange(len(self.plan))]
+        for (cost, _, job) in costs:
+            (start, w) = heapq.heappop(idle)
+            self.plan[w].append((start+cost, cost, job))
+            heapq.heappush(idle, (start+cost, w))
+        self.makespan = max(t for (t, _) in idle)
+        self.total = sum(self.costs.itervalues())
+        return
+
+    def __repr__(self):
+        return '<BatchSchedule: jobs=%d, makespan=%d>' % (len(self.jobs), self.makespan)
+
+    def write(self, outfp):
+        for (w, tasks) in enumerate(self.plan):
+            print >>outfp, 'worker %d:' % w
+            for (finish, cost, job) in tasks:
+                print >>outfp, '  %8d %8d  %s' % (finish-cost, cost, job.name)
+        print >>outfp, ('Estimated makespan: %d page(s) on %d worker(s), %d page(s) in total.' %
+                        (self.makespan, len(self.plan), self.total))
+        return
@@ -2,7 +2,10 @@
 """
 Miscellaneous Routines.
 """
+import sys
+import mmap
 import struct
+from array import array
 from sys import maxint as INF
 
 
@@ -175,6 +178,31 @@ def nunpack(s, default=0):
         raise TypeError('invalid length: %d' % l)
 
 
+# nunpack_column
+def nunpack_column(data, offset, width, step, n, default=0):
+    """Unpacks the integers of width bytes (big endian) found at
+    offset, offset+step, ... in data, for n rows, into an array."""
+    if not width:
+        return array('B', [default]) * n
+    if 4 < width:
+        return [long(data[i:i+width].encode('hex'), 16)
+                for i in xrange(offset, offset+step*n, step)]
+    # the bytes of the column are laid out as the items of an array
+    # of a standard size, padded with zeros on the left. The signed
+    # types need a byte more but their items are ints, not longs.
+    for typecode in 'BHilL':
+        size = array(typecode).itemsize
+        if width < size or (width == size and typecode in 'BHL'):
+            break
+    buf = bytearray(size*n)
+    for j in xrange(width):
+        buf[size-width+j::size] = data[offset+j:offset+j+step*(n-1)+1:step]
+    column = array(typecode, str(buf))
+    if sys.byteorder == 'little':
+        column.byteswap()
+    return column
+
+
 # decode_text
 PDFDocEncoding = ''.join(unichr(x) for x in (
     0x0000, 0x0001, 0x0002, 0x0003, 0x0004, 0x0005, 0x0006, 0x0007,
@@ -220,6 +248,27 @@ def decode_text(s):
         return ''.join(PDFDocEncoding[ord(c)] for c in s)
 
 
+def decode_filename(name):
+    """Decodes a file name to Unicode, e.g. to store it in JSON."""
+    if isinstance(name, unicode):
+        return name
+    return unicode(name, 'utf-8', 'replace')
+
+
+# map_file
+def map_file(fp):
+    """Returns a read-only memory map of an open file.
+
+    The map can be given to a PDFParser instead of the file. If the
+    file cannot be mapped (e.g. it is empty or not a real file), the
+    file itself is returned.
+    """
+    try:
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, EnvironmentError):
+        return fp
+
+
 # enc
 def enc(x, codec='utf-8'):
     """Encodes a string for SGML/XML/HTML"""
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""
+Watching a folder for new files.
+
+FolderWatcher reports the files of a folder that are new or changed
+once they have stopped growing. On Linux, the folder is watched with
+inotify (through ctypes), so a new file is noticed right away;
+elsewhere, or if inotify is not available, the folder is listed
+again at every poll interval.
+"""
+import sys
+import os
+import os.path
+import time
+import errno
+import struct
+import select
+
+# inotify(7) events.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0x00000800
+
+INOTIFY_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+##  Inotify
+##
+class Inotify(object):
+
+    """A minimal inotify watch of a single folder."""
+
+    def __init__(self, folder):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        # raises AttributeError if the C library has no inotify.
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        if libc.inotify_add_watch(self.fd, folder, INOTIFY_MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, 'inotify_add_watch: %s' % folder)
+        return
+
+    def __repr__(self):
+        return '<Inotify: fd=%d>' % self.fd
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        """Returns the names of the files that had events, or None
+        if events were lost and the folder must be listed."""
+        names = set()
+        while 1:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    break
+                raise
+            i = 0
+            while i < len(data):
+                (wd, mask, cookie, length) = INOTIFY_EVENT.unpack_from(data, i)
+                i += INOTIFY_EVENT.size
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                name = data[i:i+length].rstrip('\0')
+                i += length
+                if name:
+                    names.add(name)
+        return names
+
+    def close(self):
+        os.close(self.fd)
+        return
+
+
+##  FolderWatcher
+##
+class FolderWatcher(object):
+
+    """Finds the files of a folder that are new or changed.
+
+    A file is reported by poll() when its size and mtime did not
+    change for settle seconds, and again only when it has changed.
+    """
+
+    debug = 0
+
+    def __init__(self, folder, settle=5.0, interval=2.0, use_inotify=True):
+        self.folder = folder
+        self.settle = settle
+        self.interval = interval
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify(folder)
+            except (AttributeError, OSError), e:
+                if 1 <= self.debug:
+                    print >>sys.stderr, 'watch: no inotify, polling: %s' % e
+        # {name: (size, mtime, since)} of the files that may be new.
+        self.candidates = {}
+        # {name: (size, mtime)} of the files that were reported.
+        self.reported = {}
+        self.listed = 0
+        return
+
+    def __repr__(self):
+        return '<FolderWatcher: %r, inotify=%r, candidates=%d>' % \
+               (self.folder, self.inotify is not None, len(self.candidates))
+
+    def _list(self):
+        self.listed = time.time()
+        for name in os.listdir(self.folder):
+            self._check(name)
+        return
+
+    def _check(self, name):
+        path = os.path.join(self.folder, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.candidates.pop(name, None)
+            self.reported.pop(name, None)
+            return
+        if not os.path.isfile(path):
+            return
+        state = (st.st_size, st.st_mtime)
+        if self.reported.get(name) == state:
+            return
+        old = self.candidates.get(name)
+        if old is None or old[:2] != state:
+            self.candidates[name] = state + (time.time(),)
+        return
+
+    def poll(self, timeout=None):
+        """Waits for at most timeout seconds and returns the names
+        of the files that are ready."""
+        if timeout is None:
+            timeout = self.interval
+        if self.inotify is None:
+            wait = self.listed+self.interval-time.time()
+            if 0 < wait:
+                time.sleep(min(timeout, wait))
+            if self.listed+self.interval <= time.time():
+                self._list()
+        else:
+            if not self.listed:
+                self._list()
+            if self.candidates:
+                # wake up in time to see the candidates settle.
+                timeout = min(timeout, self.settle)
+            try:
+                (ready, _, _) = select.select([self.inotify], [], [], timeout)
+            except select.error:
+                ready = []
+            if ready:
+                names = self.inotify.read()
+                if names is None:
+                    self._list()
+                else:
+                    for name in names:
+                        self._check(name)
+        now = time.time()
+        ready = []
+        for (name, (size, mtime, since)) in self.candidates.items():
+            # without inotify, the state is refreshed by listing.
+            if self.inotify is not None:
+                self._check(name)
+                if name not in self.candidates:
+                    continue
+                (size, mtime, since) = self.candidates[name]
+            if since+self.settle <= now:
+                del self.candidates[name]
+                self.reported[name] = (size, mtime)
+                ready.append(name)
+        if 1 <= self.debug and ready:
+            print >>sys.stderr, 'watch: ready: %r' % ready
+        return sorted(ready)
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+        return
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+A pool of worker processes whose tasks are limited in time and memory.
+
+Unlike multiprocessing.Pool, every worker has its own pipe and runs
+one task at a time, so a worker that exceeds a limit can be killed
+and replaced without disturbing the others. While it runs a task, a
+worker reports the stage it is in, which tells where a task got stuck.
+"""
+import sys
+import os
+import time
+import signal
+import select
+from collections import deque
+from multiprocessing import Process, Pipe
+
+
+# get_rss
+def get_rss(pid):
+    """Returns the resident set size of a process in bytes,
+    or None if it cannot be determined (no /proc)."""
+    try:
+        fp = file('/proc/%d/statm' % pid, 'rb')
+        try:
+            fields = fp.read().split()
+        finally:
+            fp.close()
+    except (IOError, OSError):
+        return None
+    return int(fields[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+# _worker_main
+def _worker_main(conn, func):
+    def report(stage):
+        conn.send(('stage', stage))
+        return
+    while 1:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        conn.send(('done', func(task, report)))
+    conn.close()
+    return
+
+
+##  WatchdogWorker
+##
+class WatchdogWorker(object):
+
+    def __init__(self, func):
+        (self.conn, child) = Pipe()
+        self.process = Process(target=_worker_main, args=(child, func))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.task = None
+        self.started = None
+        self.stage = None
+        return
+
+    def __repr__(self):
+        return '<WatchdogWorker: pid=%r, task=%r, stage=%r>' % \
+               (self.process.pid, self.task, self.stage)
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    def assign(self, task):
+        self.task = task
+        self.started = time.time()
+        self.stage = None
+        self.conn.send(task)
+        return
+
+    def release(self):
+        task = self.task
+        self.task = None
+        self.started = None
+        return task
+
+    def kill(self):
+        try:
+            os.kill(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.process.join()
+        self.conn.close()
+        return
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (IOError, OSError):
+            pass
+        self.process.join()
+        self.conn.close()
+        return
+
+
+##  Watchdog
+##
+class Watchdog(object):
+
+    """Runs func(task, report) over tasks with a pool of processes.
+
+    timeout is the wall-clock limit of a task in seconds and maxrss
+    the limit of a worker's resident memory in bytes (0 means no
+    limit). func gets a report(stage) function it should call when a
+    task enters a new stage.
+
+    Tasks are given with submit() and their results are collected
+    with poll(), or run() does both for a list of tasks. A result is
+    a tuple (task, result, killed). killed is None when the task
+    completed, otherwise a (reason, stage) pair: the worker was
+    killed and is replaced by a new one.
+    """
+
+    debug = 0
+
+    def __init__(self, func, processes=1, timeout=0, maxrss=0, interval=0.5):
+        self.func = func
+        self.processes = processes
+        self.timeout = timeout
+        self.maxrss = maxrss
+        self.interval = interval
+        self.pending = deque()
+        self.workers = []
+        return
+
+    def __repr__(self):
+        return '<Watchdog: processes=%d, timeout=%r, maxrss=%r>' % \
+               (self.processes, self.timeout, self.maxrss)
+
+    def __len__(self):
+        """Returns the number of tasks that are pending or running."""
+        return len(self.pending) + len([w for w in self.workers if w.task is not None])
+
+    def check(self, worker):
+        """Returns the reason to kill a worker, or None."""
+        if self.timeout and self.timeout < time.time()-worker.started:
+            return 'timeout (%ss)' % self.timeout
+        if self.maxrss:
+            rss = get_rss(worker.process.pid)
+            if rss is not None and self.maxrss < rss:
+                return 'memory (%d MB)' % (rss // (1024*1024))
+        return None
+
+    def submit(self, task):
+        self.pending.append(task)
+        return
+
+    def poll(self, timeout=None):
+        """Waits for the workers for at most timeout seconds (by
+        default, the check interval) and returns the results."""
+        if timeout is None:
+            timeout = self.interval
+        # hand out tasks, starting workers as needed.
+        for worker in self.workers:
+            if not self.pending:
+                break
+            if worker.task is None:
+                worker.assign(self.pending.popleft())
+        while self.pending and len(self.workers) < self.processes:
+            worker = WatchdogWorker(self.func)
+            worker.assign(self.pending.popleft())
+            self.workers.append(worker)
+        busy = [worker for worker in self.workers if worker.task is not None]
+        if not busy:
+            return []
+        try:
+            (ready, _, _) = select.select(busy, [], [], timeout)
+        except select.error:
+            ready = []
+        results = []
+        dead = []
+        for worker in ready:
+            try:
+                (kind, value) = worker.conn.recv()
+            except EOFError:
+                dead.append((worker, 'worker died'))
+                continue
+            if kind == 'stage':
+                worker.stage = value
+            elif kind == 'done':
+                results.append((worker.release(), value, None))
+        for worker in busy:
+            if worker.task is None or worker in dict(dead):
+                continue
+            reason = self.check(worker)
+            if reason is not None:
+                dead.append((worker, reason))
+        for (worker, reason) in dead:
+            if 1 <= self.debug:
+                print >>sys.stderr, 'watchdog: killing %r: %s' % (worker, reason)
+            worker.kill()
+            self.workers.remove(worker)
+            results.append((worker.release(), None, (reason, worker.stage)))
+        return results
+
+    def close(self):
+        """Stops the workers. The running tasks are killed and
+        returned, together with the pending ones."""
+        killed = []
+        for worker in self.workers:
+            if worker.task is None:
+                worker.stop()
+            else:
+                worker.kill()
+                killed.append(worker.release())
+        self.workers = []
+        killed.extend(self.pending)
+        self.pending.clear()
+        return killed
+
+    def run(self, tasks):
+        """Runs the tasks and yields their results as they complete."""
+        for task in tasks:
+            self.submit(task)
+        try:
+            while len(self):
+                for result in self.poll():
+                    yield result
+        finally:
+            self.close()
+        return
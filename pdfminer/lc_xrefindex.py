@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+On-disk index of the cross-reference tables of PDF files.
+
+Opening a document reads its xref tables and trailers and, for a
+damaged file, scans the whole file for its objects. XRefIndex keeps
+the result in a folder: the positions of the objects and the trailer
+of every xref section. A document that is opened again with the same
+index skips the xref parsing entirely. An index is valid as long as
+the size and the content of the file do not change; like a
+BatchManifest, the content is hashed only when the mtime changed.
+"""
+import sys
+import os
+import os.path
+import errno
+import marshal
+import hashlib
+from lc_psparser import PSLiteral, PSKeyword, LIT, KWD
+from lc_pdftypes import PDFObjRef
+from lc_pdfdocument import PDFXRefIndex
+from lc_manifest import file_digest
+
+XREFINDEX_FORMAT = 1
+
+
+# encode_object
+def encode_object(obj):
+    """Turns a trailer into something that marshal can write.
+
+    Strings, numbers, booleans and None are kept as they are, the
+    other objects become tagged tuples. Raises TypeError for objects
+    that cannot be stored (e.g. streams).
+    """
+    if obj is None or isinstance(obj, (bool, int, long, float, str)):
+        return obj
+    if isinstance(obj, PDFObjRef):
+        return ('R', obj.objid)
+    if isinstance(obj, PSLiteral):
+        return ('L', obj.name)
+    if isinstance(obj, PSKeyword):
+        return ('K', obj.name)
+    if isinstance(obj, list):
+        return ('A', [encode_object(x) for x in obj])
+    if isinstance(obj, dict):
+        return ('D', dict((k, encode_object(v)) for (k, v) in obj.iteritems()))
+    raise TypeError('cannot be indexed: %r' % obj)
+
+
+# decode_object
+def decode_object(doc, obj):
+    """Reverses encode_object(); the references point to doc."""
+    if not isinstance(obj, tuple):
+        return obj
+    (tag, value) = obj
+    if tag == 'R':
+        return PDFObjRef(doc, value, 0)
+    elif tag == 'L':
+        return LIT(value)
+    elif tag == 'K':
+        return KWD(value)
+    elif tag == 'A':
+        return [decode_object(doc, x) for x in value]
+    elif tag == 'D':
+        return dict((k, decode_object(doc, v)) for (k, v) in value.iteritems())
+    raise ValueError('unknown tag: %r' % tag)
+
+
+##  XRefIndex
+##
+class XRefIndex(object):
+
+    """The index of one PDF file, kept in a folder.
+
+    Typical usage:
+      index = XRefIndex(path, folder)
+      doc = PDFDocument(parser, index=index)
+
+    The index of a file is named after the hash of its absolute path,
+    so any number of files can share a folder.
+    """
+
+    debug = 0
+
+    def __init__(self, path, folder):
+        self.path = path
+        name = hashlib.sha1(os.path.abspath(path)).hexdigest()
+        self.index_path = os.path.join(folder, name+'.xref')
+        return
+
+    def __repr__(self):
+        return '<XRefIndex: %r, %r>' % (self.path, self.index_path)
+
+    def _read(self):
+        try:
+            fp = file(self.index_path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                data = marshal.load(fp)
+            except (EOFError, ValueError, TypeError):
+                return None
+        finally:
+            fp.close()
+        if not isinstance(data, dict) or data.get('format') != XREFINDEX_FORMAT:
+            return None
+        return data
+
+    def _write(self, data):
+        folder = os.path.dirname(self.index_path)
+        # the workers of a batch may write their indexes at once.
+        tmppath = '%s.%d.tmp' % (self.index_path, os.getpid())
+        try:
+            try:
+                os.makedirs(folder)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            fp = file(tmppath, 'wb')
+            try:
+                marshal.dump(data, fp)
+            finally:
+                fp.close()
+            os.rename(tmppath, self.index_path)
+        except (IOError, OSError), e:
+            # the index is only a cache.
+            if 1 <= self.debug:
+                print >>sys.stderr, 'xrefindex: cannot write %r: %s' % (self.index_path, e)
+        return
+
+    def load(self, doc):
+        """Returns (xrefs, fallback) as PDFDocument would read them,
+        or None if there is no valid index of the file."""
+        data = self._read()
+        if data is None:
+            return None
+        st = os.stat(self.path)
+        if data['size'] != st.st_size:
+            return None
+        if data['mtime'] != st.st_mtime:
+            # touched, but maybe not modified.
+            if data['hash'] != file_digest(self.path):
+                return None
+            data['mtime'] = st.st_mtime
+            self._write(data)
+        xrefs = [PDFXRefIndex(entries, decode_object(doc, trailer))
+                 for (entries, trailer) in data['xrefs']]
+        if 1 <= self.debug:
+            print >>sys.stderr, 'xrefindex: loaded %r: xrefs=%d' % (self.path, len(xrefs))
+        return (xrefs, data['fallback'])
+
+    def save(self, xrefs, fallback):
+        """Writes the index of the xrefs of a document."""
+        st = os.stat(self.path)
+        try:
+            sections = []
+            for xref in xrefs:
+                sections.append((list(xref.get_entries()),
+                                 encode_object(xref.get_trailer())))
+        except TypeError, e:
+            if 1 <= self.debug:
+                print >>sys.stderr, 'xrefindex: not indexed %r: %s' % (self.path, e)
+            return
+        data = {'format': XREFINDEX_FORMAT, 'size': st.st_size, 'mtime': st.st_mtime,
+                'hash': file_digest(self.path), 'fallback': fallback, 'xrefs': sections}
+        self._write(data)
+        if 1 <= self.debug:
+            print >>sys.stderr, 'xrefindex: saved %r: xrefs=%d' % (self.path, len(sections))
+        return
+
+
+# get_index
+def get_index(path, folder):
+    """Returns the XRefIndex of a file, or None if folder is not set."""
+    if not folder:
+        return None
+    return XRefIndex(path, folder)